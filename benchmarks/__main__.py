@@ -0,0 +1,19 @@
+import sys
+
+
+def run_benchmark():
+    match sys.argv[1:2]:
+        case ['load']:
+            from .load import main
+
+        case ['micro']:
+            from .micro import main
+
+        case other:
+            raise ValueError(f'unknown benchmark: {other}')
+
+    main(sys.argv[2:])
+
+
+if __name__ == '__main__':
+    run_benchmark()
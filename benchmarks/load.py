@@ -0,0 +1,313 @@
+"""Websocket load generation against running examples
+
+Starts example app in subprocess (or uses already running server) and
+drives it with concurrent headless clients speaking `client.js` text
+protocol
+"""
+import asyncio
+import dataclasses as dc
+import json
+import os
+import platform
+import socket
+import statistics
+import subprocess
+import sys
+import time
+import typing as t
+
+import websockets
+
+ROOT_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+# Commands acknowledged by client in `each` ack mode
+ACKS = {
+    'UpdateLayout': 'LayoutUpdated',
+    'InsertComponent': 'LayoutUpdated',
+    'UpdateComponent': 'LayoutUpdated',
+    'RemoveComponent': 'LayoutUpdated',
+    'SetVar': 'VarSet',
+    'SetVars': 'VarSet',
+}
+
+type Action = tuple[str, dict]
+
+
+@dc.dataclass
+class Scenario:
+    example: str
+    # Events sent in loop by each client (passive client if empty)
+    actions: tuple[Action, ...] = ()
+    # Command which completes round trip of action
+    expect: tuple[str, ...] = ()
+
+
+SCENARIOS = {
+    'counter': Scenario(
+        example='counter',
+        actions=(('ButtonClick', {'button_id': 'plus'}),),
+        expect=('SetVar', 'SetVars'),
+    ),
+    'clock': Scenario(example='clock'),
+    'menu': Scenario(
+        example='menu',
+        actions=(
+            ('ButtonClick', {'button_id': 'trading'}),
+            ('ButtonClick', {'button_id': 'main'}),
+        ),
+        expect=('InsertComponent', 'UpdateLayout'),
+    ),
+    'tables': Scenario(example='tables'),
+}
+
+
+@dc.dataclass
+class Stats:
+    connect: list[float] = dc.field(default_factory=list)
+    round_trip: list[float] = dc.field(default_factory=list)
+    received: int = 0
+    errors: int = 0
+
+
+class Client:
+    def __init__(self, url: str, scenario: Scenario, stats: Stats):
+        self.url = url
+        self.scenario = scenario
+        self.stats = stats
+        self.protocol = {'acks': 'each', 'ack_every': 1}
+        self.received = 0
+        self.acked = 0
+
+    async def run(self, deadline: float) -> None:
+        started = time.perf_counter()
+        async with websockets.connect(
+            self.url, subprotocols=['sundash.text'], max_size=None,
+        ) as ws:
+            await self.wait_for(ws, ('UpdateLayout',))
+            self.stats.connect.append(time.perf_counter() - started)
+
+            if self.scenario.actions:
+                await self.act(ws, deadline)
+            else:
+                await self.listen(ws, deadline)
+
+    async def act(self, ws, deadline: float) -> None:
+        i = 0
+        while time.perf_counter() < deadline:
+            name, data = self.scenario.actions[i % len(self.scenario.actions)]
+            started = time.perf_counter()
+            await ws.send(f'{name} {json.dumps(data)}')
+            await self.wait_for(ws, self.scenario.expect)
+            self.stats.round_trip.append(time.perf_counter() - started)
+            i += 1
+
+    async def listen(self, ws, deadline: float) -> None:
+        timeout = deadline - time.perf_counter()
+        try:
+            async with asyncio.timeout(timeout):
+                while True:
+                    await self.receive(ws)
+        except TimeoutError:
+            pass
+
+    async def wait_for(self, ws, names: tuple[str, ...]) -> None:
+        while await self.receive(ws) not in names: ...
+
+    async def receive(self, ws) -> str:
+        frame = await ws.recv()
+        self.received += 1
+        self.stats.received += 1
+
+        name, data = frame.split(' ', 1)
+        if name == 'Hello':
+            self.protocol = json.loads(data)
+
+        await self.ack(ws, name)
+        return name
+
+    async def ack(self, ws, name: str) -> None:
+        if self.protocol['acks'] == 'each' and name in ACKS:
+            await ws.send(f'{ACKS[name]} {{}}')
+
+        elif self.protocol['acks'] == 'cumulative':
+            if self.received - self.acked >= self.protocol['ack_every']:
+                self.acked = self.received
+                await ws.send(f'Ack {{"seq": {self.acked}}}')
+
+
+# Server process
+
+# Examples are served at default address of `sundash.server.Server`
+EXAMPLE_HOST = '127.0.0.1'
+EXAMPLE_PORT = 5000
+
+
+def start_server(example: str) -> subprocess.Popen:
+    process = subprocess.Popen(
+        [sys.executable, '-m', 'examples', example],
+        cwd=ROOT_DIR,
+        stdout=subprocess.DEVNULL,
+        stderr=subprocess.DEVNULL,
+    )
+    for _ in range(100):
+        try:
+            socket.create_connection(
+                (EXAMPLE_HOST, EXAMPLE_PORT), timeout=0.1,
+            ).close()
+            return process
+        except OSError:
+            time.sleep(0.1)
+
+    process.kill()
+    raise RuntimeError(f'Server of `{example}` is not started')
+
+
+def read_process(pid: int | None) -> dict | None:
+    """CPU time (sec) and RSS (KiB) of process, Linux only"""
+    try:
+        with open(f'/proc/{pid}/stat') as f:
+            fields = f.read().rsplit(')', 1)[1].split()
+        with open(f'/proc/{pid}/status') as f:
+            rss = next(
+                int(line.split()[1]) for line in f if line.startswith('VmRSS')
+            )
+    except (OSError, StopIteration):
+        return None
+
+    ticks = os.sysconf('SC_CLK_TCK')
+    return {
+        'cpu': (int(fields[11]) + int(fields[12])) / ticks,
+        'rss': rss,
+    }
+
+
+# Report
+
+def percentiles(values: list[float]) -> dict | None:
+    if len(values) < 2:
+        return None
+
+    q = statistics.quantiles(values, n=100, method='inclusive')
+    return {
+        'count': len(values),
+        'p50': q[49],
+        'p90': q[89],
+        'p99': q[98],
+        'max': max(values),
+    }
+
+
+def server_report(
+    before: dict | None, connected: dict | None, after: dict | None,
+    clients: int, duration: float,
+) -> dict | None:
+    if not (before and connected and after):
+        return None
+
+    return {
+        'cpu_percent': 100 * (after['cpu'] - connected['cpu']) / duration,
+        'rss_kb_idle': before['rss'],
+        'rss_kb_loaded': after['rss'],
+        'rss_kb_per_session': (connected['rss'] - before['rss']) / clients,
+    }
+
+
+async def connect_all(clients: list[Client], deadline: float) -> list:
+    return await asyncio.gather(
+        *(client.run(deadline) for client in clients),
+        return_exceptions=True,
+    )
+
+
+async def run_load(
+    scenario_name: str,
+    *,
+    clients: int = 100,
+    duration: float = 10.0,
+    host: str = EXAMPLE_HOST,
+    port: int = EXAMPLE_PORT,
+    start: bool = True,
+) -> dict:
+    """Run load scenario, `host` and `port` are used only with `start=False`
+    """
+    scenario = SCENARIOS[scenario_name]
+    if start and (host, port) != (EXAMPLE_HOST, EXAMPLE_PORT):
+        raise ValueError(
+            f'Started example listens on {EXAMPLE_HOST}:{EXAMPLE_PORT}'
+        )
+
+    process = start_server(scenario.example) if start else None
+    pid = process and process.pid
+    try:
+        before = read_process(pid)
+        stats = Stats()
+        started = time.perf_counter()
+        deadline = started + duration
+        pool = [Client(f'ws://{host}:{port}/', scenario, stats)
+                for _ in range(clients)]
+
+        task = asyncio.create_task(connect_all(pool, deadline))
+        while len(stats.connect) < clients and not task.done():
+            await asyncio.sleep(0.05)
+
+        connected = read_process(pid)
+        connected_at = time.perf_counter()
+        results = await task
+        after = read_process(pid)
+        elapsed = time.perf_counter() - started
+
+    finally:
+        if process is not None:
+            process.terminate()
+            process.wait()
+
+    stats.errors = sum(isinstance(r, Exception) for r in results)
+    return {
+        'scenario': scenario_name,
+        'clients': clients,
+        'duration': elapsed,
+        'timestamp': time.time(),
+        'python': platform.python_version(),
+        'connect_latency': percentiles(stats.connect),
+        'round_trip': percentiles(stats.round_trip),
+        'commands_per_sec': stats.received / elapsed,
+        'errors': stats.errors,
+        'server': server_report(
+            before, connected, after,
+            clients, time.perf_counter() - connected_at,
+        ),
+    }
+
+
+def main(args: t.Sequence[str]) -> None:
+    import argparse
+
+    parser = argparse.ArgumentParser(prog='python -m benchmarks load')
+    parser.add_argument('scenario', choices=SCENARIOS)
+    parser.add_argument('-c', '--clients', type=int, default=100)
+    parser.add_argument('-d', '--duration', type=float, default=10.0)
+    parser.add_argument(
+        '--no-start', action='store_true',
+        help='use already running server instead of starting example',
+    )
+    parser.add_argument('--host', help='address of running server')
+    parser.add_argument('--port', type=int, help='port of running server')
+    parser.add_argument('-o', '--output', help='path of JSON report')
+    opts = parser.parse_args(args)
+    if not opts.no_start and (opts.host or opts.port):
+        parser.error('--host and --port require --no-start')
+
+    report = asyncio.run(run_load(
+        opts.scenario,
+        clients=opts.clients,
+        duration=opts.duration,
+        host=opts.host or EXAMPLE_HOST,
+        port=opts.port or EXAMPLE_PORT,
+        start=not opts.no_start,
+    ))
+    output = json.dumps(report, indent=2)
+    if opts.output:
+        with open(opts.output, 'w') as f:
+            f.write(output)
+
+    print(output)
@@ -0,0 +1,167 @@
+"""Microbenchmarks of framework hot path, without server and sockets
+
+Uses `pyperf` if installed, otherwise simple `timeit` based runner
+"""
+import array
+import asyncio
+import dataclasses as dc
+import statistics
+import sys
+import timeit
+import typing as t
+
+from sundash import App
+from sundash import Component
+from sundash import on
+from sundash.app import ButtonClick
+from sundash.app import Layout
+from sundash.messages import Event
+from sundash.messages import SetVar
+from sundash.messages import UpdateLayout
+from sundash.protocols import BinaryProtocol
+from sundash.protocols import TextProtocol
+from sundash.sessions import LoopbackSession
+from sundash.tables import render_columns
+from sundash.tables import render_table
+
+try:
+    import pyperf
+except ImportError:
+    pyperf = None
+
+
+class Counter(Component):
+    html = '''
+        <button id="minus">-</button>
+        <b>{{ count }}</b>
+        <button id="plus">+</button>
+    '''
+
+    @dc.dataclass
+    class Vars:
+        count: int = 0
+
+    @on(ButtonClick)
+    async def on_click(self, event: ButtonClick):
+        self.vars.count += 1
+        await self.update_var('count')
+
+
+class Static(Component):
+    html = '<p>{{ text }}</p>'
+
+    @dc.dataclass
+    class Vars:
+        text: str = 'static'
+
+
+PAGE = ['<h1>Bench</h1>', Counter, *[Static] * 20]
+
+TABLE = (
+    tuple(f'col{i}' for i in range(10)),
+    *(tuple(f'{row}:{col}' for col in range(10)) for row in range(100)),
+)
+# Same size, numeric columns are mixed with text ones
+TABLE_COLUMNS = [
+    array.array('d', range(100)) if col % 2
+    else [f'{row}:{col}' for row in range(100)]
+    for col in range(10)
+]
+
+SET_VAR = SetVar(name='count', value=42)
+UPDATE_LAYOUT = UpdateLayout(html='<b>{{ count }}</b>' * 50, vars={'count': 1})
+CLICK_FRAME = 'ButtonClick {"button_id": "plus"}'
+
+
+def make_layout() -> Layout:
+    layout = Layout(PAGE)
+    layout.current_page  # instantiate components
+    return layout
+
+
+def make_binary_protocol() -> BinaryProtocol:
+    protocol = BinaryProtocol()
+    protocol.encode(UPDATE_LAYOUT)  # assign var slots
+    return protocol
+
+
+async def make_session(app: App) -> LoopbackSession:
+    session = LoopbackSession()
+    with session:
+        await session.open()
+        await app.on_session_open()
+
+    return session
+
+
+def bench_dispatch(loops: int) -> float:
+    """`App.on_event` of button click through loopback session"""
+    async def run() -> float:
+        app = App()
+        app.raw_pages = {'*': PAGE}
+        session = await make_session(app)
+        event = ButtonClick(button_id='plus')
+
+        started = timeit.default_timer()
+        with session:
+            for _ in range(loops):
+                await app.on_event(event)
+        elapsed = timeit.default_timer() - started
+
+        await session.close()
+        return elapsed
+
+    return asyncio.run(run())
+
+
+def get_benchmarks() -> dict[str, t.Callable[[], t.Any]]:
+    layout = make_layout()
+    text, binary = TextProtocol(), make_binary_protocol()
+    return {
+        'event_get_by_name': lambda: Event.get_by_name('ButtonClick'),
+        'event_decode_text': lambda: text.decode(CLICK_FRAME),
+        'layout_callbacks_map': lambda: layout.callbacks_map,
+        'layout_get_callbacks': lambda: layout.get_callbacks(ButtonClick),
+        'layout_html': lambda: layout.html,
+        'render_table_100x10': lambda: render_table(TABLE),
+        'render_columns_100x10': lambda: render_columns(
+            TABLE[0], TABLE_COLUMNS,
+        ),
+        'encode_set_var_text': lambda: text.encode(SET_VAR),
+        'encode_set_var_binary': lambda: binary.encode(SET_VAR),
+        'encode_update_layout_text': lambda: text.encode(UPDATE_LAYOUT),
+    }
+
+
+def run_pyperf(args: t.Sequence[str]) -> None:
+    runner = pyperf.Runner(program_args=('-m', 'benchmarks', 'micro'))
+    runner.parse_args(args)
+
+    for name, func in get_benchmarks().items():
+        runner.bench_func(name, func)
+
+    runner.bench_time_func('app_dispatch_click', bench_dispatch)
+
+
+def run_timeit(repeat: int = 5) -> None:
+    def report(name: str, timings: list[float]) -> None:
+        mean, stdev = statistics.mean(timings), statistics.stdev(timings)
+        print(f'{name:<30} {mean * 1e6:>10.3f} us +- {stdev * 1e6:.3f}')
+
+    for name, func in get_benchmarks().items():
+        timer = timeit.Timer(func)
+        loops, _ = timer.autorange()
+        timings = [t / loops for t in timer.repeat(repeat, loops)]
+        report(name, timings)
+
+    loops = 10_000
+    timings = [bench_dispatch(loops) / loops for _ in range(repeat)]
+    report('app_dispatch_click', timings)
+
+
+def main(args: t.Sequence[str]) -> None:
+    if pyperf is not None:
+        run_pyperf(args)
+    else:
+        print('pyperf is not installed, using timeit', file=sys.stderr)
+        run_timeit()
@@ -1,3 +1,4 @@
+import asyncio
 import random
 from dataclasses import dataclass
 
@@ -6,7 +7,8 @@ from sundash import Component
 from sundash import on
 from sundash.app import InputUpdated
 
-app = App()
+# Handlers are run as tasks, so slow search doesn't block other input
+app = App(concurrent=True)
 
 
 class Search(Component):
@@ -15,7 +17,8 @@ class Search(Component):
             <br>
             <input
                 name="search"
-                placeholder="Type something and hit `Enter`"
+                placeholder="Type something"
+                data-live="300"
             />
             <br>
             <p>{{ results }}</p>
@@ -27,8 +30,11 @@ class Search(Component):
     class Vars:
         results: str = ''
 
-    @on(InputUpdated)
+    # Input is sent while typing, at most once per 300 ms. Search of
+    # previous input is cancelled, only latest results are shown
+    @on(InputUpdated, latest_wins=True)
     async def show_results(self, event: InputUpdated) -> None:
+        await asyncio.sleep(random.uniform(0.1, 1))  # slow query
         n = random.randint(0, 10)
         self.vars.results = f'Found {n} results for "{event.value}"'
 
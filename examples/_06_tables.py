@@ -1,5 +1,6 @@
 from sundash import App
 from sundash.tables import TableComponent
+from sundash.tables import VirtualTableComponent
 
 app = App()
 
@@ -14,4 +15,15 @@ class CompaniesTable(TableComponent):
     )
 
 
-app.run_sync(['<h1>📋 Tables</h1>', CompaniesTable])
+class OrdersTable(VirtualTableComponent):
+    # Only visible rows are sent, try to scroll, sort and filter it
+    table_data = (
+        ('order', 'company', 'amount'),
+        *(
+            (i, CompaniesTable.table_data[1 + i % 2][0], i * 37 % 1000)
+            for i in range(100_000)
+        ),
+    )
+
+
+app.run_sync(['<h1>📋 Tables</h1>', CompaniesTable, OrdersTable])
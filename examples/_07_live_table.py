@@ -0,0 +1,32 @@
+import random
+
+from sundash import on
+from sundash.scheduler import Every
+from sundash.scheduler import SchedulerApp
+from sundash.tables import LiveTableComponent
+
+app = SchedulerApp()
+
+SYMBOLS = ('BTC', 'ETH', 'SOL', 'TON', 'XRP', 'ADA', 'DOT', 'LTC')
+
+
+class Prices(LiveTableComponent):
+    headers = ('symbol', 'price', 'volume')
+
+    def __init__(self):
+        super().__init__()
+        self.prices = {symbol: random.uniform(1, 1000) for symbol in SYMBOLS}
+
+    @on(Every(0.2))
+    async def update(self, _):
+        # Only changed cells of few rows are sent to client
+        for symbol in random.sample(SYMBOLS, 2):
+            self.prices[symbol] *= random.uniform(0.99, 1.01)
+            await self.set_row(symbol, (
+                symbol,
+                f'{self.prices[symbol]:.2f}',
+                random.randint(1, 100),
+            ))
+
+
+app.run_sync(['<h1>📈 Live table</h1>', Prices])
@@ -24,6 +24,9 @@ def run_example():
         case '06' | 'tables':
             from . import _06_tables
 
+        case '07' | 'live_table':
+            from . import _07_live_table
+
         case other:
             raise ValueError(f'unknown example: {other}')
 
@@ -3,35 +3,43 @@ from __future__ import annotations
 import abc
 import asyncio
 import dataclasses as dc
+import inspect
 import logging
 import typing as t
+from collections import OrderedDict
 from collections import defaultdict
 from contextvars import ContextVar
+from functools import cache
 
+from . import cluster
+from . import metrics
 from . import utils
 from .html import HTML
-from .messages import Command
 from .messages import Event
+from .messages import InsertComponent
+from .messages import RemoveComponent
+from .messages import SetVar
+from .messages import SetVars
+from .messages import UpdateComponent
+from .messages import UpdateLayout
+from .offload import Offload
+from .offload import Offloader
 from .server import Server
 from .sessions import Session
+from .sessions import SessionConfig
+from .templates import compile_template
+from .templates import template_hash
 
 logger = logging.getLogger(__name__)
 
 
-@dc.dataclass
-class UpdateLayout(Command):
-    html: HTML
-    vars: dict = dc.field(default_factory=dict)
-
-
 @dc.dataclass
 class LayoutUpdated(Event): ...
 
 
 @dc.dataclass
-class SetVar(Command):
-    name: str
-    value: str
+class TemplateMissing(Event):
+    hash: str
 
 
 @dc.dataclass
@@ -48,9 +56,13 @@ class InputUpdated(Event):
     name: str
     value: str
 
+    _key = property(lambda self: ('input', self.name))
+
 
 type Callback = t.Callable[[Event], t.Awaitable[None]]
 type CallbacksMap = list[tuple[Event.T, Callback]]
+type CallbacksIndex = dict[Event.T, list[Callback]]
+type HandlerRunner = t.Callable[[Callback, Event], t.Awaitable[None]]
 
 type _CpName = str  # component name
 type _CbName = str  # callback name
@@ -59,7 +71,29 @@ type _ComponentRegistry = dict[_CpName, list[tuple[Event.T, _CbName]]]
 _registry: _ComponentRegistry = defaultdict(list)
 
 
-def on(event_cls: Event.T) -> t.Callable:
+@dc.dataclass(frozen=True)
+class HandlerOptions:
+    # Cancel running call of handler when new event comes (only in
+    # concurrent mode, see `App`)
+    latest_wins: bool = False
+    # Run sync handler in thread or process pool, see `offload`
+    executor: Offload | None = None
+
+
+DEFAULT_HANDLER_OPTIONS = HandlerOptions()
+
+# Options of handlers declared with non-default ones, by handler function
+_handler_options: dict[t.Callable, HandlerOptions] = {}
+
+
+def on(
+    event_cls: Event.T,
+    *,
+    latest_wins: bool = False,
+    executor: Offload | str | None = None,
+) -> t.Callable:
+    executor = Offload(executor) if executor else None
+
     def wrapper(callback: Callback) -> Callback:
         self = utils.get_f_self(callback)
         cmp_cls_name = utils.get_f_cls_name(callback)
@@ -69,10 +103,22 @@ def on(event_cls: Event.T) -> t.Callable:
         else:
             raise RuntimeError
 
+        if executor and inspect.iscoroutinefunction(callback):
+            raise ValueError('Offloaded handler should be sync function')
+
+        options = HandlerOptions(latest_wins=latest_wins, executor=executor)
+        if options != DEFAULT_HANDLER_OPTIONS:
+            _handler_options[callback] = options
+
         return callback
     return wrapper
 
 
+def get_handler_options(callback: Callback) -> HandlerOptions:
+    func = getattr(callback, '__func__', callback)
+    return _handler_options.get(func, DEFAULT_HANDLER_OPTIONS)
+
+
 class Component:
     html: HTML
 
@@ -82,17 +128,31 @@ class Component:
     def __init__(self):
         self.vars = self.Vars()
 
+    @property
+    def key(self) -> str:
+        """Identity of component in page, used for page diffs"""
+        return self.__class__.__qualname__
+
+    @property
+    def template(self) -> HTML:
+        return compile_template(self.html)
+
     @property
     def callbacks_map(self) -> CallbacksMap:
+        # Handlers of base classes are inherited
+        handlers = dict.fromkeys(
+            handler
+            for cls in reversed(self.__class__.__mro__)
+            for handler in _registry.get(cls.__name__, ())
+        )
         return [
             (event_cls, getattr(self, callback_name))
-            for event_cls, callback_name
-            in _registry[self.__class__.__name__]
+            for event_cls, callback_name in handlers
         ]
 
     async def update_var(self, name: str) -> None:
         value = getattr(self.vars, name)
-        await Session.get().send_command(SetVar(name=name, value=value))
+        await _layout.get().set_var(name, value)
 
 
 class HTMLComponent(Component):
@@ -101,9 +161,32 @@ class HTMLComponent(Component):
         super().__init__()
         self.html = html
 
+    @property
+    def key(self) -> str:
+        return 'html-' + template_hash(self.template)
+
+
+@cache
+def _get_html_component(html: HTML) -> HTMLComponent:
+    # HTML components are stateless, so single instance per string is shared
+    # between all sessions and pages
+    return HTMLComponent(html=html)
+
+
+type ComponentID = str
+
 
 class Page(list[Component]):
 
+    @property
+    def component_ids(self) -> list[ComponentID]:
+        ids = []
+        counter = defaultdict(int)
+        for component in self:
+            counter[component.key] += 1
+            ids.append(f'{component.key}-{counter[component.key]}')
+        return ids
+
     @property
     def callbacks_map(self) -> CallbacksMap:
         cb_map = []
@@ -111,6 +194,13 @@ class Page(list[Component]):
             cb_map += component.callbacks_map
         return cb_map
 
+    @property
+    def callbacks_index(self) -> CallbacksIndex:
+        index = defaultdict(list)
+        for event_cls, callback in self.callbacks_map:
+            index[event_cls].append(callback)
+        return dict(index)
+
 
 type RawPage = t.Iterable[type[Component] | HTML]
 type Route = str
@@ -120,7 +210,7 @@ def convert_to_page(raw_page: RawPage) -> Page:
     page = Page()
     for item in raw_page:
         if isinstance(item, str):
-            component = HTMLComponent(html=item)
+            component = _get_html_component(item)
         else:
             component = item()
 
@@ -132,9 +222,31 @@ _layout: ContextVar[Layout] = ContextVar('_app_layout')
 
 
 class Layout:
-    def __init__(self, raw_page: RawPage | None = None):
-        self.pages: dict[Route, Page] = {}
+    """Session pages holder
+
+    Page components are instantiated on first visit of the route. With
+    `max_pages` set, least recently visited pages are dropped (and
+    rebuilt from scratch on next visit) to bound per-session memory.
+
+    With `batch_window` set, var updates are not sent immediately, but
+    collected during the window (`0` - single event loop turn) and sent to
+    client as one `SetVars` command
+    """
+    def __init__(
+        self,
+        raw_page: RawPage | None = None,
+        *,
+        max_pages: int | None = None,
+        batch_window: float | None = None,
+    ):
+        self.raw_pages: dict[Route, RawPage] = {}
+        self.pages: OrderedDict[Route, Page] = OrderedDict()
+        self.max_pages = max_pages
+        self.batch_window = batch_window
+        self._pending_vars: dict = {}
+        self._flush_task: asyncio.Task | None = None
         self.current_route = None
+        self._callbacks_index: CallbacksIndex | None = None
 
         if raw_page is not None:
             self.add_page(route=self.current_route, page=raw_page)
@@ -143,18 +255,44 @@ class Layout:
         if not self.current_route:
             self.current_route = route
 
-        self.pages[route] = convert_to_page(page)
+        self.raw_pages[route] = page
+        self.pages.pop(route, None)
+        if route == self.current_route:
+            self._callbacks_index = None
 
     def switch_page(self, route: Route) -> None:
         self.current_route = route
+        self._callbacks_index = None
 
     @property
     def current_page(self) -> Page:
-        return self.pages[self.current_route]
+        route = self.current_route
+        if route in self.pages:
+            self.pages.move_to_end(route)
+        else:
+            self.pages[route] = convert_to_page(self.raw_pages[route])
+            self._evict_pages()
+
+        return self.pages[route]
+
+    def _evict_pages(self) -> None:
+        if self.max_pages is None:
+            return
+
+        while len(self.pages) > max(self.max_pages, 1):
+            self.pages.popitem(last=False)
 
     @property
     def html(self) -> HTML:
-        return ''.join((comp.html for comp in self.current_page))
+        page = self.current_page
+        return ''.join(
+            self.render_component(comp_id, comp.template)
+            for comp_id, comp in zip(page.component_ids, page)
+        )
+
+    @staticmethod
+    def render_component(comp_id: ComponentID, template: HTML) -> HTML:
+        return f'<sd-component data-id="{comp_id}">{template}</sd-component>'
 
     @property
     def vars(self) -> dict:
@@ -167,11 +305,172 @@ class Layout:
     def callbacks_map(self) -> CallbacksMap:
         return self.current_page.callbacks_map
 
+    def get_callbacks(self, event_cls: Event.T) -> list[Callback]:
+        """Get callbacks of current page subscribed to event class
+
+        Index is built once per page and dropped on page switch
+        """
+        if self._callbacks_index is None:
+            self._callbacks_index = self.current_page.callbacks_index
+            self._callbacks_index.setdefault(TemplateMissing, []).append(
+                self.on_template_missing
+            )
+
+        return self._callbacks_index.get(event_cls, [])
+
     async def send_update(self) -> None:
         session = Session.get()
-        command = UpdateLayout(html=self.html, vars=self.vars)
+        vars = self.vars
+        for channel in session.channels:
+            vars.update(channel.vars)
+
+        self.cancel_flush()
+        html = self.html
+        hash = template_hash(html)
+        if hash in session.templates:
+            html = None  # client will take it from cache
+        else:
+            session.templates.add(hash)
+
+        command = UpdateLayout(html=html, vars=vars, hash=hash)
         await session.send_command(command)
 
+    async def send_diff(self, old_page: Page) -> None:
+        """Send only components changed since `old_page`
+
+        Components with same identity in both pages are kept on client
+        (only vars are updated if differ). If order of kept components
+        is changed, whole layout is sent
+        """
+        new_page = self.current_page
+        old = dict(zip(old_page.component_ids, old_page))
+        new = dict(zip(new_page.component_ids, new_page))
+
+        kept = [comp_id for comp_id in new if comp_id in old]
+        if kept != [comp_id for comp_id in old if comp_id in new]:
+            await self.send_update()
+            return
+
+        await self.flush()
+        self.cancel_flush()
+
+        session = Session.get()
+        for comp_id in old:
+            if comp_id not in new:
+                await session.send_command(RemoveComponent(id=comp_id))
+
+        for index, (comp_id, comp) in enumerate(new.items()):
+            if comp_id not in old:
+                await session.send_command(self._insert(comp_id, index, comp))
+
+            elif comp.vars.__dict__ != old[comp_id].vars.__dict__:
+                command = UpdateComponent(id=comp_id, vars=comp.vars.__dict__)
+                await session.send_command(command)
+
+    def _insert(
+        self, comp_id: ComponentID, index: int, comp: Component
+    ) -> InsertComponent:
+        session = Session.get()
+        html = comp.template
+        hash = template_hash(html)
+        if hash in session.templates:
+            html = None
+        else:
+            session.templates.add(hash)
+
+        return InsertComponent(
+            id=comp_id,
+            index=index,
+            html=html,
+            hash=hash,
+            vars=dict(comp.vars.__dict__),
+        )
+
+    async def on_template_missing(self, event: TemplateMissing) -> None:
+        Session.get().templates.discard(event.hash)
+        await self.send_update()
+
+    async def set_var(self, name: str, value: t.Any) -> None:
+        if self.batch_window is None:
+            command = SetVar(name=name, value=value)
+            await Session.get().send_command(command)
+            return
+
+        self._pending_vars[name] = value
+        if self._flush_task is None:
+            self._flush_task = asyncio.create_task(self._flush_later())
+
+    async def _flush_later(self) -> None:
+        await asyncio.sleep(self.batch_window)
+        self._flush_task = None
+        await self.flush()
+
+    async def flush(self) -> None:
+        """Send var updates collected in batch window"""
+        if not self._pending_vars:
+            return
+
+        vars, self._pending_vars = self._pending_vars, {}
+        await Session.get().send_command(SetVars(vars=vars))
+
+    def cancel_flush(self) -> None:
+        self._pending_vars = {}
+        if self._flush_task is not None:
+            self._flush_task.cancel()
+            self._flush_task = None
+
+
+class Dispatcher:
+    """Runner of session event handlers as tasks
+
+    Handlers of the same component are run one by one in order of events
+    (component lock), handlers of different components run concurrently.
+    Running call of `latest_wins` handler is cancelled by next event
+    """
+    def __init__(self, run_handler: HandlerRunner):
+        self.run_handler = run_handler
+        self.locks: dict[object, asyncio.Lock] = defaultdict(asyncio.Lock)
+        self.latest: dict[Callback, asyncio.Task] = {}
+        self.tasks: set[asyncio.Task] = set()
+
+    async def run(self, callback: Callback, event: Event) -> None:
+        owner = getattr(callback, '__self__', None)
+        async with self.locks[owner]:
+            await self.run_handler(callback, event)
+
+    def spawn(self, callback: Callback, event: Event) -> None:
+        latest_wins = get_handler_options(callback).latest_wins
+        if latest_wins and callback in self.latest:
+            self.latest[callback].cancel()
+
+        task = asyncio.create_task(self._run_task(callback, event))
+        self.tasks.add(task)
+        task.add_done_callback(self.tasks.discard)
+        if latest_wins:
+            self.latest[callback] = task
+
+    async def _run_task(self, callback: Callback, event: Event) -> None:
+        try:
+            await self.run(callback, event)
+
+        except asyncio.CancelledError:
+            pass
+        except Exception as e:
+            logger.exception(e)
+
+        finally:
+            if self.latest.get(callback) is asyncio.current_task():
+                del self.latest[callback]
+
+    def cancel(self) -> None:
+        for task in self.tasks:
+            task.cancel()
+
+
+_dispatcher: ContextVar[Dispatcher | None] = ContextVar(
+    '_app_dispatcher', default=None
+)
+
 
 class AppMixinInterface(abc.ABC):
     @abc.abstractmethod
@@ -183,10 +482,42 @@ class AppMixinInterface(abc.ABC):
     @abc.abstractmethod
     async def on_event(self, event: Event) -> None: ...
 
+    @abc.abstractmethod
+    async def handle_event(self, event: Event) -> None: ...
+
 
 class App(AppMixinInterface):
-    def __init__(self):
+    """Application
+
+    By default events of session are handled one by one: next event is
+    not read until all handlers of previous one are finished. With
+    `concurrent` set, handlers are run as tasks (see `Dispatcher`), and
+    errors in them are logged instead of closing the session.
+
+    `thread_workers`, `process_workers` and `max_offloaded` configure pools
+    of offloaded handlers (`on(..., executor=...)`)
+    """
+    def __init__(
+        self,
+        *,
+        max_pages: int | None = None,
+        batch_window: float | None = None,
+        session_config: SessionConfig | None = None,
+        concurrent: bool = False,
+        thread_workers: int | None = None,
+        process_workers: int | None = None,
+        max_offloaded: int | None = None,
+    ):
         self.raw_pages: dict[Route, RawPage] = {}
+        self.max_pages = max_pages
+        self.batch_window = batch_window
+        self.session_config = session_config
+        self.concurrent = concurrent
+        self.offloader = Offloader(
+            thread_workers=thread_workers,
+            process_workers=process_workers,
+            max_pending=max_offloaded,
+        )
 
     @property
     def session(self) -> Session:
@@ -201,27 +532,67 @@ class App(AppMixinInterface):
         _layout.set(value)
 
     async def on_session_open(self) -> None:
-        layout = Layout()
+        layout = Layout(
+            max_pages=self.max_pages,
+            batch_window=self.batch_window,
+        )
         for route, page in self.raw_pages.items():
             layout.add_page(route, page)
 
         self.layout = layout
+        if self.concurrent:
+            _dispatcher.set(Dispatcher(self.run_handler))
+
         await self.layout.send_update()
 
     async def on_session_close(self) -> None:
+        for channel in tuple(self.session.channels):
+            channel.unsubscribe(self.session)
+
+        if dispatcher := _dispatcher.get():
+            dispatcher.cancel()
+            _dispatcher.set(None)
+
+        self.layout.cancel_flush()
         self.layout = None
 
+    async def on_session_resume(self, complete: bool) -> None:
+        if not complete:  # client missed commands which are not kept
+            await self.layout.send_update()
+
     async def on_event(self, event: Event) -> None:
-        for event_cls, callback in self.layout.callbacks_map:
-            if event_cls == event._cls:
+        """Handle client event (handlers are not awaited if concurrent)"""
+        dispatcher = _dispatcher.get()
+        for callback in self.layout.get_callbacks(event._cls):
+            if dispatcher is None:
+                await self.run_handler(callback, event)
+            else:
+                dispatcher.spawn(callback, event)
+
+    async def handle_event(self, event: Event) -> None:
+        """Handle server side event, waiting for all handlers"""
+        dispatcher = _dispatcher.get()
+        for callback in self.layout.get_callbacks(event._cls):
+            if dispatcher is None:
+                await self.run_handler(callback, event)
+            else:
+                await dispatcher.run(callback, event)
+
+    async def run_handler(self, callback: Callback, event: Event) -> None:
+        with metrics.handler_time.time(callback.__qualname__):
+            executor = get_handler_options(callback).executor
+            if executor is None:
                 await callback(event)
+            else:
+                await self.offloader.run(callback, event, executor)
 
     async def switch_page(self, route: Route):
         if route not in self.raw_pages:
             raise ValueError(f'Incorrect route: `{route}`')
 
+        old_page = self.layout.current_page
         self.layout.switch_page(route)
-        await self.layout.send_update()
+        await self.layout.send_diff(old_page)
 
     async def run(
         self,
@@ -240,16 +611,35 @@ class App(AppMixinInterface):
             on_session_open=self.on_session_open,
             on_session_close=self.on_session_close,
             on_event=self.on_event,
+            on_session_resume=self.on_session_resume,
+            session_config=self.session_config,
         )
-        await self.server.run()
+        if any(
+            options.executor == Offload.PROCESS
+            for options in _handler_options.values()
+        ):
+            self.offloader.start_processes()
+
+        try:
+            await self.server.run()
+        finally:
+            self.offloader.shutdown()
 
     def run_sync(
         self,
         page: RawPage = None,
         *,
         routed_pages: dict[Route, RawPage] = None,
+        workers: int = 1,
     ) -> None:
-        try:
-            asyncio.run(self.run(page, routed_pages=routed_pages))
-        except KeyboardInterrupt:
-            pass
+        """Run app, `workers > 1` forks server processes sharing the port"""
+        def run() -> None:
+            try:
+                asyncio.run(self.run(page, routed_pages=routed_pages))
+            except KeyboardInterrupt:
+                pass
+
+        if workers > 1:
+            cluster.run_workers(workers, run)
+        else:
+            run()
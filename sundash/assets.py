@@ -0,0 +1,193 @@
+"""Static assets served from memory
+
+Web assets are loaded once at server start and precompressed (gzip, and
+brotli if `brotli` package is installed). Each asset is available by its
+name with revalidation (`ETag`), and by content hashed name, like
+`client.0123456789abcdef.js`, which is cached by browser forever.
+`index.html` refers to hashed names, so only page itself is revalidated
+"""
+from __future__ import annotations
+
+import dataclasses as dc
+import gzip
+import hashlib
+import mimetypes
+import os
+
+from starlette.types import Receive
+from starlette.types import Scope
+from starlette.types import Send
+
+try:
+    import brotli
+except ImportError:
+    brotli = None
+
+INDEX_NAME = 'index.html'
+
+CACHE_REVALIDATE = b'no-cache'
+CACHE_IMMUTABLE = b'public, max-age=31536000, immutable'
+
+TEXT_TYPES = ('text/', 'application/javascript', 'application/json')
+
+
+def _compress(body: bytes) -> dict[str, bytes]:
+    encodings = {'gzip': gzip.compress(body, compresslevel=9, mtime=0)}
+    if brotli is not None:
+        encodings['br'] = brotli.compress(body)
+
+    # Compressed version is kept only if it's smaller
+    return {
+        name: data for name, data in encodings.items()
+        if len(data) < len(body)
+    }
+
+
+def _accepted_encodings(scope: Scope) -> set[str]:
+    for name, value in scope['headers']:
+        if name == b'accept-encoding':
+            return {
+                item.split(';')[0].strip()
+                for item in value.decode('latin-1').split(',')
+            }
+
+    return set()
+
+
+def _matches_etag(if_none_match: bytes, etag: str) -> bool:
+    for tag in if_none_match.decode('latin-1').split(','):
+        tag = tag.strip().removeprefix('W/').strip('"')
+        if tag == '*' or tag == etag:
+            return True
+
+    return False
+
+
+def _get_header(scope: Scope, header: bytes) -> bytes | None:
+    for name, value in scope['headers']:
+        if name == header:
+            return value
+
+    return None
+
+
+@dc.dataclass
+class Asset:
+    name: str
+    body: bytes
+    content_type: str
+    hash: str = ''
+    encodings: dict[str, bytes] = dc.field(default_factory=dict)
+
+    @classmethod
+    def load(cls, path: str, body: bytes | None = None) -> Asset:
+        if body is None:
+            with open(path, 'rb') as f:
+                body = f.read()
+
+        name = os.path.basename(path)
+        content_type = mimetypes.guess_type(name)[0]
+        content_type = content_type or 'application/octet-stream'
+        if content_type.startswith(TEXT_TYPES):
+            content_type += '; charset=utf-8'
+
+        return cls(
+            name=name,
+            body=body,
+            content_type=content_type,
+            hash=hashlib.sha1(body).hexdigest()[:16],
+            encodings=_compress(body),
+        )
+
+    @property
+    def hashed_name(self) -> str:
+        stem, ext = os.path.splitext(self.name)
+        return f'{stem}.{self.hash}{ext}'
+
+    async def send(
+        self, scope: Scope, send: Send, cache_control: bytes
+    ) -> None:
+        body, encoding = self.body, None
+        accepted = _accepted_encodings(scope)
+        for name in ('br', 'gzip'):
+            if name in accepted and name in self.encodings:
+                body, encoding = self.encodings[name], name
+                break
+
+        # Each encoding has own ETag, so caches don't mix their bytes
+        etag = f'{self.hash}-{encoding}' if encoding else self.hash
+        headers = [
+            (b'content-type', self.content_type.encode()),
+            (b'cache-control', cache_control),
+            (b'etag', f'"{etag}"'.encode()),
+            (b'vary', b'accept-encoding'),
+        ]
+        if_none_match = _get_header(scope, b'if-none-match')
+        if if_none_match and _matches_etag(if_none_match, etag):
+            await send({
+                'type': 'http.response.start',
+                'status': 304,
+                'headers': headers,
+            })
+            await send({'type': 'http.response.body', 'body': b''})
+            return
+
+        if encoding:
+            headers.append((b'content-encoding', encoding.encode()))
+
+        headers.append((b'content-length', str(len(body)).encode()))
+        await send({
+            'type': 'http.response.start',
+            'status': 200,
+            'headers': headers,
+        })
+        if scope['method'] == 'HEAD':
+            body = b''
+
+        await send({'type': 'http.response.body', 'body': body})
+
+
+class Assets:
+    """In-memory storage of static files with lookup by URL path"""
+
+    def __init__(self, directory: str, extensions: tuple[str, ...]):
+        # path -> (asset, cache control)
+        self.paths: dict[str, tuple[Asset, bytes]] = {}
+
+        assets = [
+            Asset.load(os.path.join(directory, name))
+            for name in sorted(os.listdir(directory))
+            if name.endswith(extensions) and name != INDEX_NAME
+        ]
+        for asset in assets:
+            self.paths['/' + asset.name] = (asset, CACHE_REVALIDATE)
+            self.paths['/' + asset.hashed_name] = (asset, CACHE_IMMUTABLE)
+
+        index_path = os.path.join(directory, INDEX_NAME)
+        if os.path.exists(index_path):
+            index = self.load_index(index_path, assets)
+            self.paths['/'] = self.paths['/' + INDEX_NAME] = (
+                index, CACHE_REVALIDATE,
+            )
+
+    @staticmethod
+    def load_index(path: str, assets: list[Asset]) -> Asset:
+        with open(path) as f:
+            html = f.read()
+
+        for asset in assets:
+            html = html.replace(f'"{asset.name}"', f'"{asset.hashed_name}"')
+
+        return Asset.load(path, html.encode())
+
+    async def __call__(
+        self, scope: Scope, receive: Receive, send: Send
+    ) -> bool:
+        """Send asset of request path, returns `False` if it's not found"""
+        found = self.paths.get(scope['path'])
+        if found is None:
+            return False
+
+        asset, cache_control = found
+        await asset.send(scope, send, cache_control)
+        return True
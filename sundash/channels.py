@@ -0,0 +1,107 @@
+from __future__ import annotations
+
+import asyncio
+import logging
+
+from . import cluster
+from .messages import Command
+from .messages import SetVar
+from .protocols import Frame
+from .sessions import AbstractSession
+from .sessions import Session
+
+logger = logging.getLogger(__name__)
+
+
+class Channel:
+    """Broadcast topic shared between sessions
+
+    Sessions subscribe to channel, and each published command is encoded
+    once (per session protocol) and sent to all subscribers concurrently, so
+    publishing cost depends only on number of channel subscribers.
+
+    Channel keeps last values of its vars, they are included into layout
+    of subscribed sessions
+
+    In multi-worker mode commands are also relayed to channel with the same
+    name in other workers through cluster bus
+    """
+    def __init__(self, name: str):
+        self.name = name
+        self.vars: dict = {}
+        self.subscribers: set[AbstractSession] = set()
+        _channels[name] = self
+
+    def subscribe(self, session: AbstractSession | None = None) -> None:
+        session = session or Session.get()
+        self.subscribers.add(session)
+        session.channels.add(self)
+
+    def unsubscribe(self, session: AbstractSession | None = None) -> None:
+        session = session or Session.get()
+        self.subscribers.discard(session)
+        session.channels.discard(self)
+
+    async def set_var(self, name: str, value: str) -> None:
+        self.vars[name] = value
+        await self.publish(SetVar(name=name, value=value))
+
+    async def publish(self, cmd: Command) -> None:
+        cluster.publish({
+            'type': 'channel',
+            'channel': self.name,
+            'command': cmd._name,
+            'data': cmd._data,
+        })
+        await self.send(cmd)
+
+    async def send(self, cmd: Command) -> None:
+        """Send command to subscribers of this worker only"""
+        frames: dict[str, Frame] = {}
+        sessions = list(self.subscribers)
+        sends = []
+        for session in sessions:
+            protocol = session.protocol
+            frame = frames.get(protocol.name)
+            if frame is None:
+                frame = frames[protocol.name] = protocol.encode_shared(cmd)
+
+            sends.append(session.send_frame(frame, cmd._key))
+
+        results = await asyncio.gather(*sends, return_exceptions=True)
+        for session, result in zip(sessions, results):
+            if isinstance(result, Exception):
+                await self._drop_session(session, result)
+
+        if logger.isEnabledFor(logging.INFO):
+            logger.info(
+                '[#%s:%s] CMD << %20s  %s',
+                self.name, len(sends), cmd._name, cmd._data,
+            )
+
+    async def _drop_session(
+        self, session: AbstractSession, error: Exception
+    ) -> None:
+        # Session with broken connection is not sent to anymore
+        logger.error(
+            f'[#{self.name}] Send to session {session.id} failed: {error!r}',
+            exc_info=error,
+        )
+        self.unsubscribe(session)
+        await session.close()
+
+
+_channels: dict[str, Channel] = {}
+
+
+@cluster.on_message('channel')
+async def _on_channel_message(message: cluster.Message) -> None:
+    channel = _channels.get(message['channel'])
+    if channel is None:
+        return
+
+    cmd = Command.get_by_name(message['command'])(**message['data'])
+    if isinstance(cmd, SetVar):
+        channel.vars[cmd.name] = cmd.value
+
+    await channel.send(cmd)
@@ -0,0 +1,251 @@
+"""Multi-process serving on one host
+
+`run_workers` forks N worker processes, each one runs own event loop and
+binds server socket with `SO_REUSEPORT`, so kernel balances connections
+between them. Parent process runs `Hub`, local message bus on unix socket:
+workers publish JSON lines to it, and hub relays them to other workers.
+
+State of sessions stays in worker processes, only channel broadcasts and
+session counts are shared through the bus
+"""
+from __future__ import annotations
+
+import asyncio
+import json
+import logging
+import os
+import signal
+import socket
+import tempfile
+import typing as t
+
+from . import metrics
+
+logger = logging.getLogger(__name__)
+
+type Message = dict
+type Handler = t.Callable[[Message], t.Awaitable[None]]
+
+# Bus message handlers by message type, filled by modules at import time
+_handlers: dict[str, Handler] = {}
+
+# Set in worker processes after fork
+worker_id: int | None = None
+bus: Bus | None = None
+
+_hub_path: str | None = None
+
+total_sessions = metrics.registry.add(metrics.Gauge(
+    'sundash_cluster_sessions', 'Number of open sessions in all workers',
+))
+
+
+def on_message(type_name: str) -> t.Callable[[Handler], Handler]:
+    def decorator(handler: Handler) -> Handler:
+        _handlers[type_name] = handler
+        return handler
+
+    return decorator
+
+
+def is_worker() -> bool:
+    return worker_id is not None
+
+
+def bind_sockets(host: str, port: int) -> list[socket.socket]:
+    """Server sockets which can be bound by each worker
+
+    Socket is bound to each address of host, e.g. both `127.0.0.1` and
+    `::1` of `localhost`, like single process server does
+    """
+    addresses = {
+        (family, sockaddr) for family, _, _, _, sockaddr
+        in socket.getaddrinfo(host, port, type=socket.SOCK_STREAM)
+    }
+    sockets = []
+    for family, sockaddr in sorted(addresses, key=str):
+        sock = socket.socket(family, socket.SOCK_STREAM)
+        sock.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+        sock.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEPORT, 1)
+        if family == socket.AF_INET6:
+            # Otherwise `::` would conflict with `0.0.0.0`
+            sock.setsockopt(socket.IPPROTO_IPV6, socket.IPV6_V6ONLY, 1)
+
+        sock.bind(sockaddr)
+        sockets.append(sock)
+
+    return sockets
+
+
+class Bus:
+    """Worker side of connection to hub"""
+
+    def __init__(self, reader: asyncio.StreamReader,
+                 writer: asyncio.StreamWriter):
+        self.reader = reader
+        self.writer = writer
+        self._task: asyncio.Task | None = None
+
+    @classmethod
+    async def connect(cls) -> Bus:
+        reader, writer = await asyncio.open_unix_connection(
+            _hub_path, limit=2 ** 24,
+        )
+        self = cls(reader, writer)
+        self._task = asyncio.create_task(self.listen())
+        return self
+
+    def publish(self, message: Message) -> None:
+        self.writer.write(json.dumps(message).encode() + b'\n')
+
+    async def listen(self) -> None:
+        while line := await self.reader.readline():
+            message = json.loads(line)
+            handler = _handlers.get(message['type'])
+            if handler is None:
+                continue
+
+            try:
+                await handler(message)
+            except Exception as e:
+                logger.exception(e)
+
+        logger.error('Connection to cluster hub is lost')
+
+    async def close(self) -> None:
+        if self._task is not None:
+            self._task.cancel()
+
+        self.writer.close()
+
+
+async def connect() -> None:
+    global bus
+    bus = await Bus.connect()
+
+
+def publish(message: Message) -> None:
+    """Send message to other workers (no-op in single process mode)"""
+    if bus is not None:
+        bus.publish(message)
+
+
+def report_sessions() -> None:
+    publish({'type': 'sessions', 'count': metrics.sessions.get()})
+
+
+@on_message('sessions_total')
+async def _on_sessions_total(message: Message) -> None:
+    total_sessions.set(message['count'])
+
+
+class Hub:
+    """Parent side of bus: relays messages between workers"""
+
+    def __init__(self, sock: socket.socket):
+        self.sock = sock
+        self.writers: set[asyncio.StreamWriter] = set()
+        self.sessions: dict[asyncio.StreamWriter, int] = {}
+
+    async def run(self, pids: list[int]) -> None:
+        loop = asyncio.get_running_loop()
+        stop = asyncio.Event()
+        loop.add_signal_handler(signal.SIGTERM, stop.set)
+
+        server = await asyncio.start_unix_server(
+            self.handle, sock=self.sock, limit=2 ** 24,
+        )
+        try:
+            while pids and not stop.is_set():
+                pids[:] = [pid for pid in pids if not _is_exited(pid)]
+                try:
+                    await asyncio.wait_for(stop.wait(), 0.5)
+                except TimeoutError:
+                    pass
+        finally:
+            # Not waiting for connections of workers, they are stopped after
+            server.close()
+            for writer in self.writers:
+                writer.close()
+
+    async def handle(self, reader: asyncio.StreamReader,
+                     writer: asyncio.StreamWriter) -> None:
+        self.writers.add(writer)
+        try:
+            while line := await reader.readline():
+                self.on_line(writer, line)
+        finally:
+            self.writers.discard(writer)
+            self.sessions.pop(writer, None)
+            self.send_sessions()
+            writer.close()
+
+    def on_line(self, sender: asyncio.StreamWriter, line: bytes) -> None:
+        # Only session counts are handled by hub, other lines are relayed
+        message = json.loads(line)
+        if message['type'] == 'sessions':
+            self.sessions[sender] = message['count']
+            self.send_sessions()
+            return
+
+        for writer in self.writers:
+            if writer is not sender:
+                writer.write(line)
+
+    def send_sessions(self) -> None:
+        count = sum(self.sessions.values())
+        line = json.dumps({'type': 'sessions_total', 'count': count})
+        for writer in self.writers:
+            writer.write(line.encode() + b'\n')
+
+
+def _is_exited(pid: int) -> bool:
+    try:
+        return os.waitpid(pid, os.WNOHANG)[0] == pid
+    except ChildProcessError:
+        return True
+
+
+def run_workers(workers: int, target: t.Callable[[], None]) -> None:
+    """Fork `workers` processes running `target`, serve bus until exit
+
+    Should be called before event loop is started, as forked process
+    inherits whole state of parent
+    """
+    global _hub_path, worker_id
+
+    path = os.path.join(tempfile.gettempdir(), f'sundash-{os.getpid()}.sock')
+    if os.path.exists(path):
+        os.unlink(path)
+
+    # Bound before fork, so workers can connect to hub right after start
+    hub_socket = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+    hub_socket.bind(path)
+    hub_socket.listen()
+    _hub_path = path
+
+    pids = []
+    for i in range(workers):
+        pid = os.fork()
+        if pid == 0:
+            worker_id = i
+            hub_socket.close()
+            try:
+                target()
+            finally:
+                os._exit(0)
+
+        pids.append(pid)
+
+    logger.info('Started %s workers', workers)
+    try:
+        asyncio.run(Hub(hub_socket).run(list(pids)))
+    except KeyboardInterrupt:
+        pass
+    finally:
+        for pid in pids:
+            if not _is_exited(pid):
+                os.kill(pid, signal.SIGTERM)
+                os.waitpid(pid, 0)
+
+        os.unlink(path)
@@ -1,5 +1,9 @@
+import atexit
+import copy
+import json
 import logging
 import logging.config
+import logging.handlers
 
 log_config = {
     "version": 1,
@@ -13,6 +17,9 @@ log_config = {
             ),
             "style": "{",
         },
+        "json": {
+            "()": "sundash.logging.JsonFormatter",
+        },
     },
     "filters": {},
     "handlers": {
@@ -39,5 +46,66 @@ log_config = {
 }
 
 
-def setup():
-    logging.config.dictConfig(log_config)
+# Attributes of plain `LogRecord`, other ones are passed in `extra`
+_RECORD_ATTRS = frozenset(logging.makeLogRecord({}).__dict__) | {
+    'message', 'asctime', 'taskName',
+}
+
+
+class JsonFormatter(logging.Formatter):
+    """Log record as JSON line, with all `extra` fields included"""
+
+    def format(self, record: logging.LogRecord) -> str:
+        data = {
+            'ts': record.created,
+            'level': record.levelname,
+            'logger': record.name,
+            'message': record.getMessage(),
+        }
+        for key, value in record.__dict__.items():
+            if key not in _RECORD_ATTRS:
+                data[key] = value
+
+        if record.exc_info:
+            data['exc_info'] = self.formatException(record.exc_info)
+
+        return json.dumps(data, default=str)
+
+
+_configured = False
+
+
+def setup(*, json_format: bool = False, queue: bool = False):
+    """Configure logging
+
+    * `json_format` - write structured JSON records instead of colored text
+    * `queue` - write records in background thread (through `QueueHandler`),
+      so logging calls don't block event loop on output
+    """
+    global _configured
+
+    config = copy.deepcopy(log_config)
+    if json_format:
+        config['handlers']['stdout']['formatter'] = 'json'
+
+    if queue:
+        config['handlers']['queue'] = {
+            'class': 'logging.handlers.QueueHandler',
+            'handlers': ['stdout'],
+            'respect_handler_level': True,
+        }
+        for logger_config in config['loggers'].values():
+            logger_config['handlers'] = ['queue']
+
+    logging.config.dictConfig(config)
+    _configured = True
+
+    if queue:
+        listener = logging.getHandlerByName('queue').listener
+        listener.start()
+        atexit.register(listener.stop)
+
+
+def get_server_log_config() -> dict | None:
+    # Don't let server override logging configured with `setup`
+    return None if _configured else log_config
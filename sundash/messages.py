@@ -3,15 +3,42 @@ from __future__ import annotations
 import abc
 import dataclasses as dc
 
+from .html import HTML
+
 
 class _Message(abc.ABC):
     type Name = str
     type T = type[_Message]
+    type Opcode = int
 
     _cls = property(lambda self: self.__class__)
     _name = property(lambda self: self._cls.__name__)
     _data = property(lambda self: dc.asdict(self))
 
+    _opcode: Opcode  # numeric message id in binary protocol
+
+    def __init_subclass__(cls, **kwargs):
+        super().__init_subclass__(**kwargs)
+        if len(_opcodes) >= MAX_OPCODE:
+            raise RuntimeError('Too many message classes')
+
+        cls._opcode = len(_opcodes) + 1
+        _opcodes[cls._opcode] = cls
+
+    @classmethod
+    def get_by_opcode(cls, opcode: _Message.Opcode) -> _Message.T:
+        return _opcodes[opcode]
+
+    @classmethod
+    def get_opcodes(cls) -> dict[_Message.Name, _Message.Opcode]:
+        return {msg_cls.__name__: op for op, msg_cls in _opcodes.items()}
+
+
+# Opcode 0 is reserved for protocol needs
+MAX_OPCODE = 255
+
+_opcodes: dict[_Message.Opcode, _Message.T] = {}
+
 
 @dc.dataclass
 class Event(_Message):
@@ -19,9 +46,21 @@ class Event(_Message):
     """
     type T = type[Event]
 
+    # Events with same key replace each other in session inbound buffer
+    _key = property(lambda self: None)
+
+    def __init_subclass__(cls, **kwargs):
+        super().__init_subclass__(**kwargs)
+        _events[cls.__name__] = cls
+
     @classmethod
     def get_by_name(cls, name: Event.Name) -> Event.T:
-        return {ec.__name__: ec for ec in Event.__subclasses__()}[name]
+        return _events[name]
+
+
+# Registry of all event classes (including nested subclasses),
+# filled at class definition time
+_events: dict[Event.Name, Event.T] = {}
 
 
 @dc.dataclass
@@ -29,3 +68,61 @@ class Command(_Message):
     """`Server` -> `Client` message
     """
     type T = type[Command]
+
+    # Commands with same key replace each other in outbound queue
+    _key = property(lambda self: None)
+
+    def __init_subclass__(cls, **kwargs):
+        super().__init_subclass__(**kwargs)
+        _commands[cls.__name__] = cls
+
+    @classmethod
+    def get_by_name(cls, name: Command.Name) -> Command.T:
+        return _commands[name]
+
+
+# Registry of all command classes, unlike opcodes names don't depend on
+# order of definition, so they can be used between processes
+_commands: dict[Command.Name, Command.T] = {}
+
+
+# Layout commands (used by protocols, so defined here and not in `app`)
+
+@dc.dataclass
+class UpdateLayout(Command):
+    html: HTML | None  # `None` if client has template with `hash` in cache
+    vars: dict = dc.field(default_factory=dict)
+    hash: str = ''
+
+
+@dc.dataclass
+class SetVar(Command):
+    name: str
+    value: str
+
+    _key = property(lambda self: ('var', self.name))
+
+
+@dc.dataclass
+class SetVars(Command):
+    vars: dict
+
+
+@dc.dataclass
+class InsertComponent(Command):
+    id: str
+    index: int  # position in page
+    html: HTML | None  # `None` if client has template with `hash` in cache
+    hash: str
+    vars: dict = dc.field(default_factory=dict)
+
+
+@dc.dataclass
+class UpdateComponent(Command):
+    id: str
+    vars: dict
+
+
+@dc.dataclass
+class RemoveComponent(Command):
+    id: str
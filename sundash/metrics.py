@@ -0,0 +1,178 @@
+"""In-process metrics in Prometheus text format
+
+Metrics are plain counters in memory (no locks, updated from event loop
+only), so they are cheap enough to be always on. Rendered by `Server` on
+`/metrics` path
+"""
+from __future__ import annotations
+
+import bisect
+import time
+import typing as t
+from contextlib import contextmanager
+
+type Labels = tuple[str, ...]
+
+DEFAULT_BUCKETS = (
+    .0005, .001, .0025, .005, .01, .025, .05, .1, .25, .5, 1, 2.5, 5, 10,
+)
+
+
+def _format_labels(names: Labels, values: Labels, **extra: str) -> str:
+    pairs = [*zip(names, values), *extra.items()]
+    if not pairs:
+        return ''
+
+    return '{' + ','.join(f'{k}="{v}"' for k, v in pairs) + '}'
+
+
+class _Metric:
+    type_name: str
+
+    def __init__(self, name: str, help: str, labels: Labels = ()):
+        self.name = name
+        self.help = help
+        self.labels = labels
+
+    def render(self) -> t.Iterator[str]:
+        yield f'# HELP {self.name} {self.help}'
+        yield f'# TYPE {self.name} {self.type_name}'
+        yield from self._render_values()
+
+    def _render_values(self) -> t.Iterator[str]: ...
+
+
+class Counter(_Metric):
+    type_name = 'counter'
+
+    def __init__(self, name: str, help: str, labels: Labels = ()):
+        super().__init__(name, help, labels)
+        self.values: dict[Labels, float] = {}
+
+    def inc(self, value: float = 1, *labels: str) -> None:
+        self.values[labels] = self.values.get(labels, 0) + value
+
+    def get(self, *labels: str) -> float:
+        return self.values.get(labels, 0)
+
+    def _render_values(self) -> t.Iterator[str]:
+        for labels, value in self.values.items():
+            yield f'{self.name}{_format_labels(self.labels, labels)} {value}'
+
+
+class Gauge(Counter):
+    type_name = 'gauge'
+
+    def dec(self, value: float = 1, *labels: str) -> None:
+        self.inc(-value, *labels)
+
+    def set(self, value: float, *labels: str) -> None:
+        self.values[labels] = value
+
+
+class Histogram(_Metric):
+    type_name = 'histogram'
+
+    def __init__(
+        self,
+        name: str,
+        help: str,
+        labels: Labels = (),
+        buckets: tuple[float, ...] = DEFAULT_BUCKETS,
+    ):
+        super().__init__(name, help, labels)
+        self.buckets = buckets
+        # labels -> [counts by bucket (last is +Inf)..., sum]
+        self.values: dict[Labels, list[float]] = {}
+
+    def observe(self, value: float, *labels: str) -> None:
+        data = self.values.get(labels)
+        if data is None:
+            data = self.values[labels] = [0] * (len(self.buckets) + 2)
+
+        data[bisect.bisect_left(self.buckets, value)] += 1
+        data[-1] += value
+
+    @contextmanager
+    def time(self, *labels: str) -> t.Iterator[None]:
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.observe(time.perf_counter() - start, *labels)
+
+    def _render_values(self) -> t.Iterator[str]:
+        for labels, data in self.values.items():
+            total = 0
+            for bound, count in zip((*self.buckets, '+Inf'), data):
+                total += count
+                fmt_labels = _format_labels(self.labels, labels, le=bound)
+                yield f'{self.name}_bucket{fmt_labels} {total}'
+
+            fmt_labels = _format_labels(self.labels, labels)
+            yield f'{self.name}_sum{fmt_labels} {data[-1]}'
+            yield f'{self.name}_count{fmt_labels} {total}'
+
+
+class Registry:
+    def __init__(self):
+        self.metrics: list[_Metric] = []
+
+    def add[M: _Metric](self, metric: M) -> M:
+        self.metrics.append(metric)
+        return metric
+
+    def render(self) -> str:
+        return ''.join(
+            line + '\n'
+            for metric in self.metrics
+            for line in metric.render()
+        )
+
+
+registry = Registry()
+
+sessions = registry.add(Gauge(
+    'sundash_sessions', 'Number of open sessions',
+))
+received_bytes = registry.add(Counter(
+    'sundash_received_bytes_total',
+    'Size of received frames (characters for text frames)',
+))
+sent_bytes = registry.add(Counter(
+    'sundash_sent_bytes_total',
+    'Size of sent frames (characters for text frames)',
+))
+event_parse_time = registry.add(Histogram(
+    'sundash_event_parse_seconds', 'Time of inbound frame decoding',
+))
+command_encode_time = registry.add(Histogram(
+    'sundash_command_encode_seconds', 'Time of command encoding',
+    labels=('command',),
+))
+handler_time = registry.add(Histogram(
+    'sundash_handler_seconds', 'Time of component event handlers',
+    labels=('handler',),
+))
+scheduler_lag = registry.add(Histogram(
+    'sundash_scheduler_lag_seconds', 'Delay of scheduler ticks',
+))
+queue_depth = registry.add(Histogram(
+    'sundash_queue_depth', 'Length of outbound queue when command is queued',
+    buckets=(0, 1, 2, 5, 10, 20, 50, 100, 200, 500, 1000),
+))
+queue_dropped = registry.add(Counter(
+    'sundash_queue_dropped_total', 'Commands dropped from outbound queues',
+))
+queue_coalesced = registry.add(Counter(
+    'sundash_queue_coalesced_total',
+    'Commands replaced by newer ones in outbound queues',
+))
+events_coalesced = registry.add(Counter(
+    'sundash_events_coalesced_total',
+    'Events replaced by newer ones in inbound buffers',
+))
+offload_rejected = registry.add(Counter(
+    'sundash_offload_rejected_total',
+    'Offloaded handler calls rejected by pending calls limit',
+))
@@ -0,0 +1,127 @@
+"""Running of blocking and CPU-bound handlers out of event loop
+
+Offloaded handler is a regular (not async) function, it returns dict of
+component var updates, which are applied and sent to client on the loop:
+
+    @on(ButtonClick, executor='process')
+    def build_report(self, event):
+        return {'report': crunch_numbers()}
+
+In thread pool handler is called with copy of session context. In process
+pool it's called with pickled copy of component, so changes of component
+state other than returned vars are lost.
+
+Process pool workers are forked when app starts, before any threads are
+created. Where fork is not available (Windows) they're spawned and import
+main module again, so it should run app under `if __name__ == '__main__'`
+"""
+from __future__ import annotations
+
+import asyncio
+import concurrent.futures
+import contextvars
+import enum
+import logging
+import multiprocessing
+import typing as t
+
+from . import metrics
+
+logger = logging.getLogger(__name__)
+
+
+class Offload(enum.StrEnum):
+    THREAD = 'thread'
+    PROCESS = 'process'
+
+
+def _get_mp_context() -> multiprocessing.context.BaseContext:
+    # Forked workers don't import main module, which usually runs server
+    if 'fork' in multiprocessing.get_all_start_methods():
+        return multiprocessing.get_context('fork')
+
+    return multiprocessing.get_context('spawn')
+
+
+class Offloader:
+    """Thread and process pools of app, created on first use
+
+    With `max_pending` set, handler calls over the limit (running and
+    waiting in pools queues) are rejected with warning
+    """
+    def __init__(
+        self,
+        *,
+        thread_workers: int | None = None,
+        process_workers: int | None = None,
+        max_pending: int | None = None,
+    ):
+        self.thread_workers = thread_workers
+        self.process_workers = process_workers
+        self.max_pending = max_pending
+        self.pending = 0
+        self.pools: dict[Offload, concurrent.futures.Executor] = {}
+
+    def get_pool(self, offload: Offload) -> concurrent.futures.Executor:
+        pool = self.pools.get(offload)
+        if pool is None:
+            if offload == Offload.THREAD:
+                pool = concurrent.futures.ThreadPoolExecutor(
+                    self.thread_workers, thread_name_prefix='sundash',
+                )
+            else:
+                pool = concurrent.futures.ProcessPoolExecutor(
+                    self.process_workers, mp_context=_get_mp_context(),
+                )
+            self.pools[offload] = pool
+
+        return pool
+
+    def start_processes(self) -> None:
+        """Start process pool workers in advance
+
+        Forking of process with running threads (e.g. of thread pool) is
+        unsafe, and warned about since Python 3.12
+        """
+        # Forked pool launches all workers on first call
+        self.get_pool(Offload.PROCESS).submit(int)
+
+    async def run(
+        self, callback: t.Callable, event: t.Any, offload: Offload
+    ) -> None:
+        if self.max_pending is not None and self.pending >= self.max_pending:
+            logger.warning(
+                f'Call of `{callback.__qualname__}` is rejected: '
+                f'{self.pending} calls are pending'
+            )
+            metrics.offload_rejected.inc()
+            return
+
+        loop = asyncio.get_running_loop()
+        pool = self.get_pool(offload)
+        component = callback.__self__
+
+        self.pending += 1
+        try:
+            if offload == Offload.THREAD:
+                context = contextvars.copy_context()
+                result = await loop.run_in_executor(
+                    pool, context.run, callback, event,
+                )
+            else:
+                # Function and component are pickled, not the bound method
+                result = await loop.run_in_executor(
+                    pool, callback.__func__, component, event,
+                )
+        finally:
+            self.pending -= 1
+
+        for name, value in (result or {}).items():
+            setattr(component.vars, name, value)
+            await component.update_var(name)
+
+    def shutdown(self) -> None:
+        for pool in self.pools.values():
+            pool.shutdown(wait=False, cancel_futures=True)
+
+        self.pools.clear()
@@ -0,0 +1,146 @@
+from __future__ import annotations
+
+import abc
+import dataclasses as dc
+import json
+import struct
+
+from .messages import Command
+from .messages import Event
+from .messages import InsertComponent
+from .messages import SetVar
+from .messages import UpdateLayout
+
+type Frame = str | bytes
+
+
+@dc.dataclass
+class Hello(Command):
+    """Protocol settings, first command sent to client (always as text)"""
+    acks: str
+    ack_every: int
+    ack_interval: float
+    opcodes: dict = dc.field(default_factory=dict)
+    session: str = ''  # token of resumable session
+
+
+@dc.dataclass
+class Ack(Event):
+    """Cumulative acknowledgement of commands received by client"""
+    seq: int
+
+
+class Protocol(abc.ABC):
+    """Wire format of messages, negotiated as websocket subprotocol
+
+    Protocol instance is created per session and may keep session state
+    used for encoding (`encode`), while `encode_shared` result doesn't
+    depend on it and can be sent to any session with same protocol
+    """
+    name: str
+
+    @property
+    def opcodes(self) -> dict[str, int]:
+        return {}
+
+    def encode(self, cmd: Command) -> Frame:
+        return self.encode_shared(cmd)
+
+    @abc.abstractmethod
+    def encode_shared(self, cmd: Command) -> Frame: ...
+
+    @abc.abstractmethod
+    def decode(self, frame: Frame) -> Event: ...
+
+
+class TextProtocol(Protocol):
+    """`<ClassName> <json>` text frames"""
+    name = 'sundash.text'
+
+    def encode_shared(self, cmd: Command) -> Frame:
+        cmd_name = cmd.__class__.__name__
+        cmd_params = json.dumps(cmd.__dict__)
+        return f'{cmd_name} {cmd_params}'
+
+    def decode(self, frame: Frame) -> Event:
+        name, data = frame.split(" ", 1)
+        event_cls = Event.get_by_name(name)
+
+        return event_cls(**json.loads(data))
+
+
+class BinaryProtocol(TextProtocol):
+    """Binary frames with numeric opcodes instead of class names
+
+    * `<u8 opcode><json>` - any message (see `_Message.get_opcodes`)
+    * `<u8 0><u16 slot><json value>` - `SetVar` of var in slot, where slots
+      are indexes of vars in order of last `UpdateLayout` (new vars of
+      `InsertComponent` are added to the end)
+
+    Opcodes table is sent to client in (text) `Hello` command. Text frames
+    are still decoded as `TextProtocol`
+    """
+    name = 'sundash.bin'
+
+    SLOT_OPCODE = 0
+    _slot_header = struct.Struct('!BH')
+
+    def __init__(self):
+        self.slots: dict[str, int] = {}
+
+    @property
+    def opcodes(self) -> dict[str, int]:
+        return Command.get_opcodes()
+
+    def encode(self, cmd: Command) -> Frame:
+        if isinstance(cmd, Hello):
+            return super().encode_shared(cmd)
+
+        elif isinstance(cmd, UpdateLayout):
+            self.slots = {name: i for i, name in enumerate(cmd.vars)}
+
+        elif isinstance(cmd, InsertComponent):
+            for name in cmd.vars:
+                self.slots.setdefault(name, len(self.slots))
+
+        elif isinstance(cmd, SetVar) and cmd.name in self.slots:
+            header = self._slot_header.pack(
+                self.SLOT_OPCODE, self.slots[cmd.name]
+            )
+            return header + json.dumps(cmd.value).encode()
+
+        return self.encode_shared(cmd)
+
+    def encode_shared(self, cmd: Command) -> Frame:
+        return bytes((cmd._opcode,)) + json.dumps(cmd.__dict__).encode()
+
+    def decode(self, frame: Frame) -> Event:
+        if isinstance(frame, str):
+            return super().decode(frame)
+
+        event_cls = Event.get_by_opcode(frame[0])
+        if not issubclass(event_cls, Event):
+            raise ValueError(f'Incorrect event opcode: {frame[0]}')
+
+        return event_cls(**json.loads(frame[1:]))
+
+
+PROTOCOLS: dict[str, type[Protocol]] = {
+    TextProtocol.name: TextProtocol,
+    BinaryProtocol.name: BinaryProtocol,
+}
+
+
+def negotiate(
+    offered: list[str], allowed: tuple[str, ...]
+) -> type[Protocol] | None:
+    """Choose subprotocol offered by client, in order of server preference
+
+    Return `None` if client doesn't offer any supported subprotocols,
+    so text protocol should be used without subprotocol confirmation
+    """
+    for name in allowed:
+        if name in offered and name in PROTOCOLS:
+            return PROTOCOLS[name]
+
+    return None
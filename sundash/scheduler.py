@@ -1,41 +1,279 @@
+from __future__ import annotations
+
 import asyncio
+import contextvars
+import dataclasses as dc
+import datetime
+import heapq
 import logging
-from contextvars import ContextVar
+import time
+import typing as t
 
+from . import metrics
 from .app import App
 from .app import AppMixinInterface
+from .app import Layout
+from .app import _registry
 from .messages import Event
+from .sessions import AbstractSession
 from .sessions import Session
 
 logger = logging.getLogger(__name__)
 
 
-class EverySecond(Event): ...
+class Tick(Event):
+    """Base class for periodic scheduler events"""
+    interval: float
 
+    def __init_subclass__(cls, **kwargs):
+        super().__init_subclass__(**kwargs)
+        if 'interval' in cls.__dict__:
+            _ticks.setdefault(cls.interval, cls)
 
-_scheduler_task: ContextVar[asyncio.Task] = ContextVar('_scheduler_task')
+    @classmethod
+    def next_time(cls, now: float) -> float:
+        """Wall clock time of first tick after `now`"""
+        # Aligned to wall clock, so ticks of all workers (and all processes
+        # on the host) are in phase
+        return now - now % cls.interval + cls.interval
 
 
-class SchedulerMixin(AppMixinInterface):
+_ticks: dict[float | str, type[Tick]] = {}
 
-    async def on_session_open(self) -> None:
-        await super().on_session_open()
-        task = asyncio.create_task(self.scheduler())
-        _scheduler_task.set(task)
 
-    async def on_session_close(self) -> None:
-        await super().on_session_close()
-        _scheduler_task.get().cancel()
-        _scheduler_task.set(None)
+class EverySecond(Tick):
+    interval = 1.0
+
+
+def Every(interval: float) -> type[Tick]:
+    """Get event class emitted every `interval` seconds
+
+    `Every(1) is EverySecond`, other intervals are created on demand:
+
+        @on(Every(0.1))
+        async def update(self, _): ...
+    """
+    interval = float(interval)
+    if interval <= 0:
+        raise ValueError(f'Incorrect interval: `{interval}`')
+
+    if interval not in _ticks:
+        type(f'Every{interval:g}s', (Tick,), {'interval': interval})
+
+    return _ticks[interval]
+
+
+# Cron fields: minute, hour, day of month, month, day of week (0 - Sunday)
+_CRON_RANGES = ((0, 59), (0, 23), (1, 31), (1, 12), (0, 7))
+
+
+def _parse_cron_field(field: str, low: int, high: int) -> frozenset[int]:
+    values: set[int] = set()
+    for part in field.split(','):
+        span, _, step = part.partition('/')
+        if span == '*':
+            start, end = low, high
+        elif '-' in span:
+            start, end = map(int, span.split('-'))
+        else:
+            start = int(span)
+            end = high if step else start
+
+        if not low <= start <= end <= high:
+            raise ValueError(f'Incorrect cron field: `{field}`')
+
+        values.update(range(start, end + 1, int(step or 1)))
+
+    return frozenset(values)
+
+
+class CronTick(Tick):
+    """Base class of events emitted by cron schedule, see `Cron`"""
+    schedule: str
+    fields: tuple[frozenset[int], ...]
+    any_day: tuple[bool, bool]  # day of month and day of week are `*`
+
+    def __init_subclass__(cls, **kwargs):
+        super().__init_subclass__(**kwargs)
+        if 'schedule' in cls.__dict__:
+            _ticks.setdefault(cls.schedule, cls)
+
+    @classmethod
+    def _match_day(cls, time: datetime.datetime) -> bool:
+        _, _, days, months, weekdays = cls.fields
+        if time.month not in months:
+            return False
+
+        match_day = time.day in days
+        match_weekday = (time.weekday() + 1) % 7 in weekdays
+        if any(cls.any_day):
+            return match_day and match_weekday
+
+        return match_day or match_weekday  # like in cron
+
+    @classmethod
+    def next_time(cls, now: float) -> float:
+        minutes, hours, *_ = cls.fields
+        time = datetime.datetime.fromtimestamp(now).replace(
+            second=0, microsecond=0,
+        ) + datetime.timedelta(minutes=1)
+
+        limit = time + datetime.timedelta(days=366 * 4)
+        while time < limit:
+            if not cls._match_day(time):
+                time = time.replace(hour=0, minute=0)
+                time += datetime.timedelta(days=1)
+            elif time.hour not in hours:
+                time = time.replace(minute=0) + datetime.timedelta(hours=1)
+            elif time.minute not in minutes:
+                time += datetime.timedelta(minutes=1)
+            else:
+                return time.timestamp()
+
+        raise ValueError(f'Cron schedule never matches: `{cls.schedule}`')
+
+
+def Cron(schedule: str) -> type[CronTick]:
+    """Get event class emitted by cron schedule in local time
+
+    Schedule has 5 fields: minute, hour, day of month, month and day of
+    week, each one is `*` or list of values, ranges and steps:
+
+        @on(Cron('*/15 9-18 * * 1-5'))
+        async def refresh(self, _): ...
+    """
+    schedule = ' '.join(schedule.split())
+    if schedule not in _ticks:
+        fields = schedule.split(' ')
+        if len(fields) != len(_CRON_RANGES):
+            raise ValueError(f'Incorrect cron schedule: `{schedule}`')
+
+        *other_fields, weekdays = (
+            _parse_cron_field(field, low, high)
+            for field, (low, high) in zip(fields, _CRON_RANGES)
+        )
+        # Sunday is both 0 and 7
+        weekdays = frozenset(day % 7 for day in weekdays)
+        tick_cls = type(f'Cron[{schedule}]', (CronTick,), {
+            'schedule': schedule,
+            'fields': (*other_fields, weekdays),
+            'any_day': (fields[2] == '*', fields[4] == '*'),
+        })
+        tick_cls.next_time(time.time())  # check that it's not empty
+
+    return _ticks[schedule]
 
-    async def scheduler(self):
-        event = EverySecond()
-        session = Session.get()
+
+def _get_tick_classes() -> set[type[Tick]]:
+    return {
+        event_cls
+        for handlers in _registry.values()
+        for event_cls, _ in handlers
+        if issubclass(event_cls, Tick)
+    }
+
+
+@dc.dataclass
+class _Subscriber:
+    layout: Layout
+    on_event: t.Callable[[Event], t.Awaitable[None]]
+    context: contextvars.Context
+    task: asyncio.Task | None = None
+
+
+class Scheduler:
+    """Process-wide timer shared by all sessions
+
+    Single task keeps a heap of tick deadlines (one per tick class used in
+    component handlers) and dispatches each tick to sessions which have
+    handlers for it, `batch_size` sessions per event loop turn. Tick
+    classes of handlers registered later are added when session subscribes.
+
+    When the loop is behind schedule, missed ticks are skipped, and session
+    is not ticked while its previous tick handler is still running
+    """
+    def __init__(self, batch_size: int = 500):
+        self.batch_size = batch_size
+        self.subscribers: dict[AbstractSession, _Subscriber] = {}
+        self.lag = 0.0  # delay of last tick, sec
+        self.scheduled: set[type[Tick]] = set()
+        self._changed = asyncio.Event()
+        self._task: asyncio.Task | None = None
+
+    def add(
+        self,
+        session: AbstractSession,
+        layout: Layout,
+        on_event: t.Callable[[Event], t.Awaitable[None]],
+    ) -> None:
+        context = contextvars.copy_context()
+        self.subscribers[session] = _Subscriber(layout, on_event, context)
+
+        if self._task is None:
+            self._task = asyncio.create_task(self.run())
+
+        elif _get_tick_classes() - self.scheduled:
+            self._changed.set()
+
+    def remove(self, session: AbstractSession) -> None:
+        subscriber = self.subscribers.pop(session, None)
+        if subscriber and subscriber.task:
+            subscriber.task.cancel()
+
+        if not self.subscribers and self._task is not None:
+            self._task.cancel()
+            self._task = None
+
+    async def run(self) -> None:
+        # (wall clock deadline, order, tick class)
+        heap: list[tuple[float, int, type[Tick]]] = []
+        self.scheduled = set()
+        while True:
+            self._changed.clear()
+            now = time.time()
+            for tick_cls in _get_tick_classes() - self.scheduled:
+                self.scheduled.add(tick_cls)
+                deadline = tick_cls.next_time(now)
+                heapq.heappush(heap, (deadline, len(self.scheduled), tick_cls))
+
+            timeout = heap[0][0] - now if heap else None
+            try:
+                await asyncio.wait_for(self._changed.wait(), timeout)
+                continue  # new tick classes
+            except TimeoutError:
+                pass
+
+            deadline, i, tick_cls = heapq.heappop(heap)
+            self.lag = max(time.time() - deadline, 0.0)
+            metrics.scheduler_lag.observe(self.lag)
+            await self.dispatch(tick_cls())
+
+            # Missed ticks are skipped, next one is after current time
+            now = max(time.time(), deadline)
+            heapq.heappush(heap, (tick_cls.next_time(now), i, tick_cls))
+
+    async def dispatch(self, event: Tick) -> None:
+        subscribers = list(self.subscribers.values())
+        for i in range(0, len(subscribers), self.batch_size):
+            for subscriber in subscribers[i:i + self.batch_size]:
+                self._tick(subscriber, event)
+
+            await asyncio.sleep(0)
+
+    def _tick(self, subscriber: _Subscriber, event: Tick) -> None:
+        if subscriber.task is not None and not subscriber.task.done():
+            return
+
+        if not subscriber.layout.get_callbacks(event._cls):
+            return
+
+        subscriber.task = asyncio.create_task(
+            self._handle(subscriber, event), context=subscriber.context
+        )
+
+    async def _handle(self, subscriber: _Subscriber, event: Tick) -> None:
         try:
-            with session:
-                while True:
-                    await self.on_event(event)
-                    await asyncio.sleep(1)
+            await subscriber.on_event(event)
 
         except asyncio.CancelledError:
             pass
@@ -43,4 +281,19 @@ class SchedulerMixin(AppMixinInterface):
             logger.exception(e)
 
 
+scheduler = Scheduler()
+
+
+class SchedulerMixin(AppMixinInterface):
+
+    async def on_session_open(self) -> None:
+        await super().on_session_open()
+        # Scheduler waits for tick handlers, to skip ticks of busy sessions
+        scheduler.add(Session.get(), self.layout, self.handle_event)
+
+    async def on_session_close(self) -> None:
+        scheduler.remove(Session.get())
+        await super().on_session_close()
+
+
 class SchedulerApp(SchedulerMixin, App): ...
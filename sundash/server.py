@@ -1,26 +1,37 @@
 import asyncio
+import contextvars
 import logging
 import os
 import typing as t
 
 import uvicorn
 from starlette.responses import HTMLResponse
-from starlette.staticfiles import StaticFiles
+from starlette.responses import PlainTextResponse
 from starlette.types import Receive
 from starlette.types import Scope
 from starlette.types import Send
 from starlette.websockets import WebSocket
 
-from .logging import log_config
+from . import cluster
+from . import metrics
+from . import protocols
+from .assets import Assets
+from .logging import get_server_log_config
 from .messages import Event
-from .sessions import Session
 from .sessions import AbstractSession
+from .sessions import Session
 from .sessions import SessionClosed
+from .sessions import SessionConfig
 
 logger = logging.getLogger(__name__)
 
 type _ServerCallback[T] = t.Callable[[T], t.Awaitable[None]]
 
+# Detached session with its context and expiration timer
+type _Detached = tuple[
+    AbstractSession, contextvars.Context, asyncio.TimerHandle
+]
+
 EXIT_CODE = 1
 
 response_404 = HTMLResponse(content='<b>404</b> Not found', status_code=404)
@@ -34,10 +45,9 @@ class _ASGIServer(uvicorn.Server):
 
 
 class Server:
-    ALLOWED_STATIC_FILES = ('.html', 'css', '.js', '.map', '.ico')
+    ALLOWED_STATIC_FILES = ('.html', '.css', '.js', '.map', '.ico')
 
     STATIC_DIR = os.path.dirname(__file__) + '/web'
-    INDEX_HTML_PATH = STATIC_DIR + '/index.html'
 
     def __init__(
         self,
@@ -45,17 +55,26 @@ class Server:
         on_session_open: _ServerCallback[None],
         on_session_close: _ServerCallback[None],
         on_event: _ServerCallback[Event],
+        on_session_resume: _ServerCallback[bool] | None = None,
         host: str = 'localhost',
         port: int = 5000,
         session_cls: type[AbstractSession] = Session,
+        session_config: SessionConfig | None = None,
+        metrics_path: str | None = '/metrics',
     ):
         self.host, self.port = host, port
-        self.static_files = StaticFiles(directory=self.STATIC_DIR)
+        self.assets = Assets(self.STATIC_DIR, self.ALLOWED_STATIC_FILES)
 
         self.on_session_open = on_session_open
         self.on_session_close = on_session_close
         self.on_event = on_event
+        self.on_session_resume = on_session_resume
         self.session_cls = session_cls
+        self.session_config = session_config or SessionConfig()
+        self.metrics_path = metrics_path
+
+        self.detached: dict[str, _Detached] = {}  # by session token
+        self._closing: set[asyncio.Task] = set()
 
     async def run(self) -> None:
         config = uvicorn.Config(
@@ -63,13 +82,18 @@ class Server:
             host=self.host,
             port=self.port,
             log_level='debug',
-            log_config=log_config,
+            log_config=get_server_log_config(),
         )
         server = _ASGIServer(config=config)
 
+        sockets = None
+        if cluster.is_worker():
+            sockets = cluster.bind_sockets(self.host, self.port)
+            await cluster.connect()
+
         logger.info('Starting server')
         try:
-            await server.serve()
+            await server.serve(sockets=sockets)
         finally:
             logger.info('Shutting down server')
 
@@ -109,38 +133,116 @@ class Server:
     async def handle_http_request(
         self, scope: Scope, receive: Receive, send: Send
     ) -> None:
-        path = self.static_files.get_path(scope)
-
-        if path == '.':
-            resp = await self.static_files.get_response(
-                self.INDEX_HTML_PATH, scope
-            )
-            await resp(scope, receive, send)
+        if scope['method'] not in ('GET', 'HEAD'):
+            await response_405(scope, receive, send)
 
-        elif any([path.endswith(ext) for ext in self.ALLOWED_STATIC_FILES]):
-            await self.static_files(scope, receive, send)
+        elif self.metrics_path and scope['path'] == self.metrics_path:
+            await self.handle_metrics_request(scope, receive, send)
 
-        else:
+        elif not await self.assets(scope, receive, send):
             await response_404(scope, receive, send)
 
+    async def handle_metrics_request(
+        self, scope: Scope, receive: Receive, send: Send
+    ) -> None:
+        resp = PlainTextResponse(
+            content=metrics.registry.render(),
+            media_type='text/plain; version=0.0.4',
+        )
+        await resp(scope, receive, send)
+
     async def handle_websocket_request(
         self, scope: Scope, receive: Receive, send: Send
     ) -> None:
         socket = WebSocket(scope=scope, receive=receive, send=send)
-        await socket.accept()
 
-        with self.session_cls(socket) as session:
+        protocol_cls = protocols.negotiate(
+            scope.get('subprotocols', []), self.session_config.protocols
+        )
+        if protocol_cls is None:
+            await socket.accept()
+            protocol = protocols.TextProtocol()
+        else:
+            await socket.accept(subprotocol=protocol_cls.name)
+            protocol = protocol_cls()
+
+        detached = self.detached.pop(socket.query_params.get('resume'), None)
+        if detached is not None:
+            session, context, expire_handle = detached
+            expire_handle.cancel()
+            if session.protocol.name == protocol.name:
+                seq = int(socket.query_params.get('seq', 0))
+                await asyncio.create_task(
+                    self.resume_session(session, socket, seq),
+                    context=context,
+                )
+                return
+
+            self._expire(session, context)
+
+        with self.session_cls(
+            socket, self.session_config, protocol
+        ) as session:
+            await session.open()
             await self.on_session_open()
-            try:
-                while True:
-                    event = await session.listen_event()
-                    await self.on_event(event=event)
+            await self.serve_session(session)
+
+    async def resume_session(
+        self, session: AbstractSession, socket: WebSocket, seq: int
+    ) -> None:
+        session.attach(socket)
+        complete = await session.resume(seq)
+        logger.info(f'[{session.id}] Session is resumed from #{seq}')
+
+        if self.on_session_resume is not None:
+            await self.on_session_resume(complete)
+
+        await self.serve_session(session)
+
+    async def serve_session(self, session: AbstractSession) -> None:
+        metrics.sessions.inc()
+        cluster.report_sessions()
+        lost = False
+        try:
+            while True:
+                event = await session.listen_event()
+                await self.on_event(event=event)
 
-            except (SessionClosed, asyncio.CancelledError):
-                pass
+        except SessionClosed:
+            lost = True
 
-            except Exception as e:
-                logger.exception(e)
+        except asyncio.CancelledError:
+            pass
+
+        except Exception as e:
+            logger.exception(e)
+
+        finally:
+            metrics.sessions.dec()
+            cluster.report_sessions()
+            if lost and session.token and not session.closed:
+                await self.detach_session(session)
+            else:
+                await self.close_session(session)
+
+    async def detach_session(self, session: AbstractSession) -> None:
+        await session.detach()
+        context = contextvars.copy_context()
+        expire_handle = asyncio.get_running_loop().call_later(
+            session.config.resume_ttl, self._expire, session, context,
+        )
+        self.detached[session.token] = (session, context, expire_handle)
+
+    def _expire(
+        self, session: AbstractSession, context: contextvars.Context
+    ) -> None:
+        self.detached.pop(session.token, None)
+        task = asyncio.create_task(
+            self.close_session(session), context=context
+        )
+        self._closing.add(task)
+        task.add_done_callback(self._closing.discard)
 
-            finally:
-                await self.on_session_close()
+    async def close_session(self, session: AbstractSession) -> None:
+        await self.on_session_close()
+        await session.close()
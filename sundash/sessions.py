@@ -1,15 +1,29 @@
 from __future__ import annotations
 
 import abc
-import json
+import asyncio
+import dataclasses as dc
+import enum
+import itertools
 import logging
+import secrets
+import time
 import typing as t
+from collections import OrderedDict
+from collections import deque
 from contextvars import ContextVar
 
 from starlette import websockets
 
+from . import metrics
 from .messages import Command
 from .messages import Event
+from .protocols import Ack
+from .protocols import BinaryProtocol
+from .protocols import Frame
+from .protocols import Hello
+from .protocols import Protocol
+from .protocols import TextProtocol
 
 logger = logging.getLogger(__name__)
 
@@ -19,10 +33,118 @@ _session: ContextVar[AbstractSession] = ContextVar('_session')
 class SessionClosed(Exception): ...
 
 
+_traced_messages = itertools.count()
+
+
+def _is_traced(sample: int) -> bool:
+    # Checked before any serialization of message for log
+    if not logger.isEnabledFor(logging.INFO):
+        return False
+
+    return sample <= 1 or next(_traced_messages) % sample == 0
+
+
+class AckMode(enum.StrEnum):
+    EACH = 'each'  # client acknowledges each command
+    CUMULATIVE = 'cumulative'  # client sends `Ack` every N commands / T sec
+    NONE = 'none'
+
+
+class Overflow(enum.StrEnum):
+    """Policy of full outbound queue"""
+    BLOCK = 'block'  # sender waits for free space
+    # Oldest queued var update is set aside (or block if none), latest
+    # values of set aside vars are sent once queue is drained
+    DROP = 'drop'
+    DISCONNECT = 'disconnect'  # slow client is disconnected
+
+
+@dc.dataclass
+class SessionConfig:
+    acks: AckMode = AckMode.EACH
+    ack_every: int = 100  # commands
+    ack_interval: float = 1.0  # sec
+
+    # Outbound queue drained by writer task, `None` - send inline
+    queue_size: int | None = None
+    coalesce: bool = True  # keep only latest queued value of same var
+    overflow: Overflow = Overflow.DROP
+    max_latency: float | None = None  # sec, disconnect if queued longer
+
+    # Inbound buffer filled by reader task, `None` - read on demand
+    inbox_size: int | None = 100
+
+    # Keep session for `resume_ttl` sec after connection is lost, so client
+    # can reconnect and receive missed commands, `None` - close at once
+    resume_ttl: float | None = None
+    resume_buffer: int = 1000  # max number of commands kept for replay
+
+    log_sample: int = 1  # trace only 1 of N messages
+    log_html: bool = False  # trace full markup instead of '...'
+    # Allowed websocket subprotocols, in order of preference
+    protocols: tuple[str, ...] = (BinaryProtocol.name, TextProtocol.name)
+
+
+@dc.dataclass
+class _QueueItem:
+    data: Command | Frame
+    queued_at: float
+    key: t.Hashable | None  # var of update, `None` - can't be dropped
+
+
 class AbstractSession(abc.ABC):
+    """Client session
+
+    Commands are sent inline by default. With `SessionConfig.queue_size`
+    set, they are put to bounded outbound queue and sent by writer task,
+    so slow client doesn't stall handlers. Queue keeps only latest value of
+    each var (`Command._key`), and on overflow applies `Overflow` policy.
+
+    Inbound events are read ahead to buffer while handlers are running,
+    and buffered event is replaced by newer one with same `Event._key`
+    (e.g. `InputUpdated` of the same input while user is typing).
+
+    Resumable session (`SessionConfig.resume_ttl`) keeps last sent frames,
+    it can be detached from lost connection and resumed on new one
+    """
     type ID = str
     id: ID
 
+    def __init__(
+        self,
+        config: SessionConfig | None = None,
+        protocol: Protocol | None = None,
+    ):
+        self.config = config or SessionConfig()
+        self.protocol = protocol or TextProtocol()
+        self.channels: set = set()  # subscribed `channels.Channel`s
+        self.sent_seq = 0  # number of commands sent to client
+        self.templates: set[str] = set()  # hashes of client cached templates
+        self.acked_seq = 0  # number of commands acknowledged by client
+        self.closed = False
+
+        self.token = ''
+        self.replay: deque[tuple[int, Frame]] | None = None  # (seq, frame)
+        self.detached = False
+        if self.config.resume_ttl is not None:
+            self.token = secrets.token_urlsafe(16)
+            self.replay = deque(maxlen=self.config.resume_buffer)
+
+        self.queue: OrderedDict[t.Hashable, _QueueItem] = OrderedDict()
+        self.queue_dropped = 0
+        self.deferred: OrderedDict[t.Hashable, _QueueItem] = OrderedDict()
+        self.queue_coalesced = 0
+        self._queue_ready = asyncio.Event()
+        self._queue_space = asyncio.Event()
+        self._writer: asyncio.Task | None = None
+
+        self.inbox: OrderedDict[t.Hashable, Event] = OrderedDict()
+        self.inbox_coalesced = 0
+        self._inbox_ready = asyncio.Event()
+        self._inbox_space = asyncio.Event()
+        self._inbox_error: Exception | None = None
+        self._reader: asyncio.Task | None = None
+
     def __enter__(self):
         _session.set(self)
         return self
@@ -37,26 +159,298 @@ class AbstractSession(abc.ABC):
     @abc.abstractmethod
     async def _listen_event(self) -> Event: ...
 
+    def encode_command(self, cmd: Command) -> Frame:
+        return self.protocol.encode(cmd)
+
     @abc.abstractmethod
-    async def _send_command(self, cmd: Command) -> None: ...
+    async def _send_frame(self, frame: Frame) -> None: ...
+
+    @abc.abstractmethod
+    async def _close(self, code: int) -> None: ...
+
+    async def open(self) -> None:
+        if self.config.queue_size is not None:
+            self._writer = asyncio.create_task(self._write_queue())
+
+        if self.config.inbox_size is not None:
+            self._inbox_error = None
+            self._reader = asyncio.create_task(self._read_events())
+
+        await self.send_command(Hello(
+            acks=self.config.acks,
+            ack_every=self.config.ack_every,
+            ack_interval=self.config.ack_interval,
+            opcodes=self.protocol.opcodes,
+            session=self.token,
+        ))
 
     async def listen_event(self) -> Event:
-        event = await self._listen_event()
+        event = await self._next_event()
+        while isinstance(event, Ack):
+            # Protocol level events are handled here and not passed to app
+            self._ack(event.seq)
+            event = await self._next_event()
+
+        if _is_traced(self.config.log_sample):
+            self._trace('EVN >>', event._name, event._data)
+
+        return event
+
+    async def _next_event(self) -> Event:
+        if self._reader is None:
+            return await self._listen_event()
+
+        while not self.inbox:
+            if self._inbox_error is not None:
+                raise self._inbox_error
 
-        logger.info(f'[{self.id}] EVN >> {event._name:>20}  {event._data}')
+            self._inbox_ready.clear()
+            await self._inbox_ready.wait()
+
+        _, event = self.inbox.popitem(last=False)
+        self._inbox_space.set()
         return event
 
+    async def _read_events(self) -> None:
+        try:
+            while True:
+                event = await self._listen_event()
+                if isinstance(event, Ack):
+                    self._ack(event.seq)
+                    continue
+
+                await self._put_event(event)
+
+        except asyncio.CancelledError:
+            pass
+        except Exception as e:  # including `SessionClosed`
+            self._inbox_error = e
+            self._inbox_ready.set()
+
+    async def _put_event(self, event: Event) -> None:
+        key = event._key
+        if key is None:
+            key = object()  # unique key, never coalesced
+
+        elif key in self.inbox:
+            # Replaced in place, so event keeps order with other events
+            self.inbox[key] = event
+            self.inbox_coalesced += 1
+            metrics.events_coalesced.inc()
+            return
+
+        while len(self.inbox) >= self.config.inbox_size:
+            self._inbox_space.clear()
+            await self._inbox_space.wait()
+
+        self.inbox[key] = event
+        self._inbox_ready.set()
+
+    def _ack(self, seq: int) -> None:
+        self.acked_seq = max(self.acked_seq, seq)
+        while self.replay and self.replay[0][0] <= self.acked_seq:
+            self.replay.popleft()
+
+    async def detach(self) -> None:
+        """Keep resumable session after connection is lost
+
+        Queued and further commands are not sent, only kept in replay buffer
+        """
+        self.detached = True
+        if self._writer is not None:
+            self._writer.cancel()
+            self._writer = None
+
+        if self._reader is not None:
+            self._reader.cancel()
+            self._reader = None
+
+        while self.queue:
+            _, item = self.queue.popitem(last=False)
+            await self._write(item.data)
+
+        while self.deferred:
+            _, item = self.deferred.popitem(last=False)
+            await self._write(item.data)
+
+    async def resume(self, seq: int) -> bool:
+        """Reopen detached session and replay commands sent after `seq`
+
+        Returns `False` if some of missed commands are not kept anymore, in
+        that case nothing is replayed and client state should be rebuilt
+        """
+        first_seq = self.replay[0][0] if self.replay else self.sent_seq + 1
+        complete = first_seq <= seq + 1 and seq <= self.sent_seq
+        frames = [frame for i, frame in self.replay if i > seq]
+        if not complete:
+            frames = []
+            self.replay.clear()
+
+        while self.replay and self.replay[-1][0] > seq:
+            self.replay.pop()
+
+        # Continue numbering from client side, replayed frames get new seqs
+        self.sent_seq = self.acked_seq = seq
+        self.detached = False
+        await self.open()
+        for frame in frames:
+            await self._push(frame, None)
+
+        return complete
+
+    async def close(self) -> None:
+        self.closed = True
+        self._queue_space.set()
+        if self._writer is not None:
+            self._writer.cancel()
+
+        if self._reader is not None:
+            self._reader.cancel()
+            self._inbox_error = SessionClosed()
+            self._inbox_ready.set()
+
+    async def disconnect(self, reason: str) -> None:
+        logger.warning(f'[{self.id}] Disconnecting: {reason}')
+        await self.close()
+        self.queue.clear()
+        self.deferred.clear()
+        await self._close(code=1013)  # try again later
+
     async def send_command(self, cmd: Command) -> None:
-        await self._send_command(cmd)
+        await self._push(cmd, cmd._key)
+
+        if _is_traced(self.config.log_sample):
+            fmt_data = cmd._data
+            if 'html' in fmt_data and not self.config.log_html:
+                fmt_data['html'] = '...'
+
+            self._trace('CMD <<', cmd._name, fmt_data)
+
+    def _trace(self, direction: str, name: str, data: dict) -> None:
+        logger.info(
+            '[%s] %s %20s  %s', self.id, direction, name, data,
+            extra={
+                'session_id': self.id,
+                'direction': direction,
+                'msg_name': name,
+                'msg_data': data,
+            },
+        )
+
+    async def send_frame(
+        self, frame: Frame, key: t.Hashable | None = None
+    ) -> None:
+        """Send already encoded command (see `encode_command`)"""
+        await self._push(frame, key)
+
+    @property
+    def queue_depth(self) -> int:
+        return len(self.queue)
+
+    async def _push(self, data: Command | Frame, key: t.Hashable) -> None:
+        if self.closed:
+            return
+
+        if self._writer is None:
+            await self._write(data)
+            return
+
+        item = _QueueItem(data, time.monotonic(), key)
+        if key is not None:
+            self.deferred.pop(key, None)  # superseded by newer value
+
+        if key is None or not self.config.coalesce:
+            key = object()  # unique key, never coalesced
+
+        elif key in self.queue:
+            del self.queue[key]
+            self.queue_coalesced += 1
+            metrics.queue_coalesced.inc()
+
+        if await self._make_room():
+            metrics.queue_depth.observe(len(self.queue))
+            self.queue[key] = item
+            self._queue_ready.set()
+
+    async def _make_room(self) -> bool:
+        if self._is_late():
+            await self.disconnect('max latency exceeded')
+            return False
+
+        while len(self.queue) >= self.config.queue_size and not self.closed:
+            if self.config.overflow == Overflow.DISCONNECT:
+                await self.disconnect('outbound queue is full')
+
+            elif self.config.overflow == Overflow.BLOCK or not self._drop():
+                self._queue_space.clear()
+                await self._queue_space.wait()
+
+        return not self.closed
+
+    def _is_late(self) -> bool:
+        if self.config.max_latency is None or not self.queue:
+            return False
+
+        oldest = next(iter(self.queue.values()))
+        return time.monotonic() - oldest.queued_at > self.config.max_latency
+
+    def _drop(self) -> bool:
+        for queue_key, item in self.queue.items():
+            if item.key is not None:
+                del self.queue[queue_key]
+                self.queue_dropped += 1
+                metrics.queue_dropped.inc()
+
+                # Dropped update may be the latest value of var, so it's
+                # sent later unless newer one is queued (without coalescing)
+                if not any(i.key == item.key for i in self.queue.values()):
+                    self.deferred[item.key] = item
+
+                return True
+
+        return False
+
+    async def _write(self, data: Command | Frame) -> None:
+        if isinstance(data, Command):
+            with metrics.command_encode_time.time(data._name):
+                data = self.encode_command(data)
+
+        self.sent_seq += 1
+        if self.replay is not None:
+            self.replay.append((self.sent_seq, data))
+
+        if not self.detached:
+            await self._send_frame(data)
+            metrics.sent_bytes.inc(len(data))
 
-        fmt_data = cmd._data
-        if 'html' in fmt_data:
-            fmt_data['html'] = '...'  # TODO: Need to move to logging level
+    async def _write_queue(self) -> None:
+        try:
+            while True:
+                if not self.queue and self.deferred:
+                    _, item = self.deferred.popitem(last=False)
+                    await self._write(item.data)
+                    continue
+
+                if not self.queue:
+                    self._queue_ready.clear()
+                    await self._queue_ready.wait()
+                    continue
 
-        logger.info(f'[{self.id}] CMD << {cmd._name:>20}  {fmt_data}')
+                _, item = self.queue.popitem(last=False)
+                self._queue_space.set()
+                await self._write(item.data)
+
+        except asyncio.CancelledError:
+            pass
+        except Exception as e:
+            # Senders waiting for queue space and listener are released
+            logger.exception(e)
+            await self.close()
 
 
 class Session(AbstractSession):
+    MAX_TEMPLATES = 64  # max number of cached templates reported by client
+
     __id = 0
 
     @classmethod
@@ -64,25 +458,95 @@ class Session(AbstractSession):
         cls.__id += 1
         return cls.__id
 
-    def __init__(self, socket: websockets.WebSocket):
+    def __init__(
+        self,
+        socket: websockets.WebSocket,
+        config: SessionConfig | None = None,
+        protocol: Protocol | None = None,
+    ):
+        super().__init__(config, protocol)
         self.id = str(self.__class__.new_id())
-        self.socket = socket
+        self.attach(socket)
 
-    def _parse_event(self, message: str) -> Event:
-        name, data = message.split(" ", 1)
-        event_cls = Event.get_by_name(name)
+    def attach(self, socket: websockets.WebSocket) -> None:
+        """Use new connection, on open or resume of session"""
+        self.socket = socket
 
-        return event_cls(**json.loads(data))
+        # Client reports its cached templates in `?templates=<h1>,<h2>...`
+        templates = socket.query_params.get('templates', '')
+        self.templates.update(
+            templates.split(',')[:self.MAX_TEMPLATES] if templates else ()
+        )
 
     async def _listen_event(self) -> Event:
+        message = await self.socket.receive()
+        if message['type'] == 'websocket.disconnect':
+            raise SessionClosed
+
+        frame = message.get('text')
+        if frame is None:
+            frame = message['bytes']
+
+        metrics.received_bytes.inc(len(frame))
+        with metrics.event_parse_time.time():
+            return self.protocol.decode(frame)
+
+    async def _send_frame(self, frame: Frame) -> None:
+        if isinstance(frame, bytes):
+            await self.socket.send_bytes(frame)
+        else:
+            await self.socket.send_text(frame)
+
+    async def _close(self, code: int) -> None:
         try:
-            message = await self.socket.receive_text()
-            return self._parse_event(message)
+            await self.socket.close(code=code)
+        except RuntimeError:
+            pass  # already closed
+
+
+class LoopbackSession(AbstractSession):
+    """In-process session with queue transport, without websocket
+
+    Client side puts events (or encoded event frames) to `events` and
+    reads encoded commands from `frames`. Used to drive app directly in
+    tests and benchmarks:
 
-        except websockets.WebSocketDisconnect:
+        session = LoopbackSession()
+        with session:
+            await session.open()
+            await app.on_session_open()
+            await session.events.put(ButtonClick(button_id='plus'))
+            await app.on_event(await session.listen_event())
+    """
+    __id = 0
+
+    @classmethod
+    def new_id(cls) -> int:
+        cls.__id += 1
+        return cls.__id
+
+    def __init__(
+        self,
+        config: SessionConfig | None = None,
+        protocol: Protocol | None = None,
+    ):
+        super().__init__(config, protocol)
+        self.id = f'loopback-{self.__class__.new_id()}'
+        self.events: asyncio.Queue[Event | Frame | None] = asyncio.Queue()
+        self.frames: asyncio.Queue[Frame] = asyncio.Queue()
+
+    async def _listen_event(self) -> Event:
+        event = await self.events.get()
+        if event is None:
             raise SessionClosed
 
-    async def _send_command(self, cmd: Command):
-        cmd_name = cmd.__class__.__name__
-        cmd_params = json.dumps(cmd.__dict__)
-        await self.socket.send_text(f'{cmd_name} {cmd_params}')
+        if not isinstance(event, Event):
+            event = self.protocol.decode(event)
+
+        return event
+
+    async def _send_frame(self, frame: Frame) -> None:
+        self.frames.put_nowait(frame)
+
+    async def _close(self, code: int) -> None:
+        self.events.put_nowait(None)
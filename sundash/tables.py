@@ -1,31 +1,481 @@
+from __future__ import annotations
+
+import array
+import dataclasses as dc
+import html
+import re
+import typing as t
+from collections import OrderedDict
+
 from .app import Component
+from .app import on
 from .html import HTML
-from .html import table
-from .html import td
-from .html import th
-from .html import tr
+from .messages import Command
+from .messages import Event
+from .sessions import Session
 
 type _DatasheetRow = tuple[str, ...]
 type _Datasheet = tuple[_DatasheetRow, ...]  # first row using as data header
 
+# Sequence of cell values: list, tuple, `array.array`, NumPy array or any
+# other object supporting 1-d buffer protocol
+type Column = t.Sequence | array.array | memoryview
+
+# Rows are built by joining cells with separators, one call per row/table
+_CELL_SEP = '</td><td>'
+_ROW_SEP = '</td></tr><tr><td>'
+
+
+def _join_rows(rows: t.Iterable[t.Iterable[str]]) -> HTML:
+    html_rows = _ROW_SEP.join(map(_CELL_SEP.join, rows))
+    return f'<tr><td>{html_rows}</td></tr>' if html_rows else ''
+
+
+def render_rows(rows: t.Iterable[_DatasheetRow]) -> HTML:
+    return _join_rows(map(str, row) for row in rows)
+
 
 def render_table(data: _Datasheet) -> HTML:
     headers, *rows = data
 
-    html_headers = tr(th(item) for item in headers)
-    html_items = [tr(td(item) for item in row) for row in rows]
+    html_headers = '</th><th>'.join(map(str, headers))
+    html_rows = render_rows(rows)
+    return f'<table><tr><th>{html_headers}</th></tr>{html_rows}</table>'
+
+
+# Columnar data
+
+_UNSAFE_RE = re.compile('[&<>]')
+_SAFE_DTYPE_KINDS = 'biufcmM'  # NumPy numbers, bools and dates
+
+
+def escape_column(values: list[str]) -> list[str]:
+    """Escape HTML in cells of column with single `html.escape` call"""
+    joined = '\0'.join(values)
+    if not _UNSAFE_RE.search(joined):
+        return values
+
+    escaped = html.escape(joined, quote=False).split('\0')
+    if len(escaped) != len(values):  # separator is found in values
+        return [html.escape(value, quote=False) for value in values]
 
-    return table([html_headers, *html_items])
+    return escaped
+
+
+def format_column(column: Column) -> list[str]:
+    """Texts of column cells, escaped for HTML"""
+    dtype = getattr(column, 'dtype', None)
+    if dtype is not None:  # NumPy array, formatted by NumPy itself
+        values = column.astype(str).tolist()
+        if dtype.kind in _SAFE_DTYPE_KINDS:
+            return values
+
+        return escape_column(values)
+
+    if isinstance(column, array.array) and column.typecode not in 'uw':
+        return list(map(str, column.tolist()))
+
+    if not isinstance(column, (list, tuple, str, array.array)):
+        try:
+            return list(map(str, memoryview(column).tolist()))
+        except TypeError:
+            pass  # not a buffer, iterated as sequence
+
+    return escape_column(list(map(str, column)))
+
+
+def iter_column_rows(
+    columns: t.Sequence[Column], chunk_rows: int = 1000
+) -> t.Iterator[HTML]:
+    """Render rows of column-oriented data by chunks of `chunk_rows`
+
+    Cells are formatted and escaped column by column, only one chunk is
+    kept in memory
+    """
+    length = min(map(len, columns), default=0)
+    for start in range(0, length, chunk_rows):
+        stop = min(start + chunk_rows, length)
+        cells = [format_column(column[start:stop]) for column in columns]
+        yield _join_rows(zip(*cells))
+
+
+def render_columns(
+    headers: t.Sequence[str], columns: t.Sequence[Column]
+) -> HTML:
+    html_headers = '</th><th>'.join(map(html.escape, headers))
+    return ''.join([
+        f'<table><tr><th>{html_headers}</th></tr>',
+        *iter_column_rows(columns),
+        '</table>',
+    ])
 
 
 # Framework adapter
 
+# Rendered tables are shared between all sessions: component class ->
+# (datasheet which was rendered, html)
+_render_cache: dict[type, tuple[_Datasheet, HTML]] = {}
+
+
 class TableComponent(Component):
     table_data: _Datasheet = None
 
+    def __init__(self):
+        super().__init__()
+        self.html = self.render()
+
+    @classmethod
+    def render(cls) -> HTML:
+        """Render `table_data` once per process
+
+        Reassigning `table_data` is detected automatically, in-place changes
+        of mutable data require explicit call of `invalidate`
+        """
+        if cls.table_data is None:
+            raise ValueError('`table_data` param is missing')
+
+        cached = _render_cache.get(cls)
+        if cached is not None and cached[0] is cls.table_data:
+            return cached[1]
+
+        html = render_table(cls.table_data)
+        _render_cache[cls] = (cls.table_data, html)
+        return html
+
+    @classmethod
+    def invalidate(cls) -> None:
+        _render_cache.pop(cls, None)
+
+
+# Virtual table
+
+@dc.dataclass
+class TableScroll(Event):
+    table: str
+    offset: int  # first visible row
+
+
+@dc.dataclass
+class TableSort(Event):
+    table: str
+    column: int
+
+
+@dc.dataclass
+class TableFilter(Event):
+    table: str
+    query: str
+
+
+@dc.dataclass
+class UpdateRows(Command):
+    table: str
+    offset: int  # position of first row in (sorted and filtered) data
+    total: int  # number of rows in data
+    html: HTML
+
+
+type _Sort = tuple[int, bool] | None  # column, descending
+type _ViewKey = tuple[type, _Sort, str]
+
+# Sorted and filtered rows are shared between sessions: (component class,
+# sort, filter query) -> (datasheet, rows)
+_view_cache: OrderedDict[_ViewKey, tuple[_Datasheet, list]] = OrderedDict()
+VIEW_CACHE_SIZE = 64
+
+
+def _sort_rows(
+    rows: list[_DatasheetRow], column: int, descending: bool
+) -> list[_DatasheetRow]:
+    try:
+        return sorted(
+            rows, key=lambda row: row[column], reverse=descending
+        )
+    except TypeError:  # mixed types, e.g. `None` and numbers
+        return sorted(
+            rows, key=lambda row: _mixed_sort_key(row[column]),
+            reverse=descending,
+        )
+
+
+def _mixed_sort_key(value: t.Any) -> tuple[int, t.Any]:
+    # Numbers first, then other values as strings, then `None`
+    if value is None:
+        return (2, '')
+    if isinstance(value, (int, float)):
+        return (0, value)
+    return (1, str(value))
+
+
+class VirtualTableComponent(Component):
+    """Table which sends to client only a window of rows
+
+    Client requests new window on scroll, sort (click on header) and
+    filter input, they are applied to whole `table_data` on server. So
+    size of payload and DOM depends on `window_size`, not on data size.
+
+    Only one instance of each table class can be shown on page
+    """
+    table_data: _Datasheet = None
+    window_size: int = 50  # rows
+    row_height: int = 40  # px
+    height: int = 600  # px
+
     def __init__(self):
         super().__init__()
         if self.table_data is None:
             raise ValueError('`table_data` param is missing')
 
-        self.html = render_table(self.table_data)
+        self.html = self.render_frame()
+        self.offset = 0
+        self.sort: _Sort = None
+        self.query = ''
+
+    @classmethod
+    def render_frame(cls) -> HTML:
+        headers = ''.join(
+            f'<th data-sort="{i}">{name}</th>'
+            for i, name in enumerate(cls.table_data[0])
+        )
+        return (
+            f'<div class="sd-table" data-table="{cls.__qualname__}" '
+            f'data-row-height="{cls.row_height}" '
+            f'style="--sd-row-height: {cls.row_height}px">'
+            '<input data-table-filter placeholder="Filter"/>'
+            f'<div class="sd-table-viewport" style="height: {cls.height}px">'
+            f'<table><thead><tr>{headers}</tr></thead><tbody></tbody></table>'
+            '</div></div>'
+        )
+
+    def get_view(self) -> list[_DatasheetRow]:
+        """Rows of `table_data` after filter and sort"""
+        data = self.table_data
+        key = (self.__class__, self.sort, self.query)
+        cached = _view_cache.get(key)
+        if cached is not None and cached[0] is data:
+            _view_cache.move_to_end(key)
+            return cached[1]
+
+        rows = data[1:]
+        if self.query:
+            query = self.query.lower()
+            rows = [
+                row for row in rows
+                if any(query in str(item).lower() for item in row)
+            ]
+        if self.sort is not None:
+            rows = _sort_rows(rows, *self.sort)
+
+        _view_cache[key] = (data, rows)
+        if len(_view_cache) > VIEW_CACHE_SIZE:
+            _view_cache.popitem(last=False)
+
+        return rows
+
+    async def send_rows(self) -> None:
+        rows = self.get_view()
+        offset = max(min(self.offset, len(rows) - self.window_size), 0)
+        await Session.get().send_command(UpdateRows(
+            table=self.key,
+            offset=offset,
+            total=len(rows),
+            html=render_rows(rows[offset:offset + self.window_size]),
+        ))
+
+    @on(TableScroll)
+    async def on_table_scroll(self, event: TableScroll) -> None:
+        if event.table == self.key:
+            # Window starts a bit above visible rows, for scrolling up
+            self.offset = event.offset - self.window_size // 4
+            await self.send_rows()
+
+    @on(TableSort)
+    async def on_table_sort(self, event: TableSort) -> None:
+        columns = len(self.table_data[0])
+        if event.table == self.key and (
+            isinstance(event.column, int) and 0 <= event.column < columns
+        ):
+            descending = self.sort == (event.column, False)
+            self.sort = (event.column, descending)
+            self.offset = 0
+            await self.send_rows()
+
+    @on(TableFilter)
+    async def on_table_filter(self, event: TableFilter) -> None:
+        if event.table == self.key:
+            self.query = event.query
+            self.offset = 0
+            await self.send_rows()
+
+
+# Streamed columnar table
+
+@dc.dataclass
+class TableLoad(Event):
+    table: str
+
+
+@dc.dataclass
+class AppendRows(Command):
+    table: str
+    html: HTML
+
+
+class ColumnarTableComponent(Component):
+    """Table of column-oriented data, streamed to client by chunks
+
+    Rows are requested by client after table is shown, and sent as series
+    of `AppendRows` commands, `chunk_rows` rows each. So neither server
+    nor session outbound frames hold whole rendered table
+    """
+    headers: tuple[str, ...] = None
+    columns: t.Sequence[Column] = None
+    chunk_rows: int = 1000
+
+    def __init__(self):
+        super().__init__()
+        if self.headers is None or self.columns is None:
+            raise ValueError('`headers` and `columns` params are required')
+
+        self.html = self.render_frame()
+
+    @classmethod
+    def render_frame(cls) -> HTML:
+        headers = '</th><th>'.join(map(html.escape, cls.headers))
+        return (
+            f'<table data-stream="{cls.__qualname__}">'
+            f'<thead><tr><th>{headers}</th></tr></thead><tbody></tbody>'
+            '</table>'
+        )
+
+    @on(TableLoad)
+    async def on_table_load(self, event: TableLoad) -> None:
+        if event.table != self.key:
+            return
+
+        session = Session.get()
+        for chunk in iter_column_rows(self.columns, self.chunk_rows):
+            await session.send_command(AppendRows(table=self.key, html=chunk))
+
+
+# Live table
+
+@dc.dataclass
+class InsertRow(Command):
+    table: str
+    key: str
+    index: int  # position in table
+    cells: list
+
+
+@dc.dataclass
+class UpdateCells(Command):
+    table: str
+    key: str
+    cells: dict  # column index -> value, only changed cells
+
+
+@dc.dataclass
+class DeleteRow(Command):
+    table: str
+    key: str
+
+
+def _render_keyed_row(key: str, cells: list[str]) -> HTML:
+    html_cells = _CELL_SEP.join(map(html.escape, cells))
+    return f'<tr data-key="{html.escape(key)}"><td>{html_cells}</td></tr>'
+
+
+def render_keyed_rows(rows: dict[str, list[str]]) -> HTML:
+    return ''.join(
+        _render_keyed_row(key, cells) for key, cells in rows.items()
+    )
+
+
+class LiveTableComponent(Component):
+    """Table with rows identified by key, changed in place
+
+    Client loads all rows when table is shown, after that only changes
+    are sent: `InsertRow`, `DeleteRow` and `UpdateCells` with changed
+    cells only. Cell values are kept as strings
+    """
+    headers: tuple[str, ...] = None
+
+    def __init__(self):
+        super().__init__()
+        if self.headers is None:
+            raise ValueError('`headers` param is missing')
+
+        self.html = self.render_frame()
+        self.rows: dict[str, list[str]] = {}
+
+    @classmethod
+    def render_frame(cls) -> HTML:
+        headers = '</th><th>'.join(map(html.escape, cls.headers))
+        return (
+            f'<table data-stream="{cls.__qualname__}" data-live>'
+            f'<thead><tr><th>{headers}</th></tr></thead><tbody></tbody>'
+            '</table>'
+        )
+
+    async def set_row(
+        self, key: t.Hashable, cells: t.Iterable, index: int | None = None
+    ) -> None:
+        """Insert row (to the end by default) or update its changed cells
+
+        Negative `index` counts from the end, like in `list.insert`
+        """
+        key, cells = str(key), list(map(str, cells))
+        if len(cells) != len(self.headers):
+            raise ValueError(
+                f'Row has {len(cells)} cells, {len(self.headers)} expected'
+            )
+
+        old_cells = self.rows.get(key)
+        if old_cells is None:
+            await self._insert_row(key, cells, index)
+            return
+
+        changed = {
+            i: value
+            for i, (old_value, value) in enumerate(zip(old_cells, cells))
+            if old_value != value
+        }
+        if changed:
+            self.rows[key] = cells
+            await Session.get().send_command(
+                UpdateCells(table=self.key, key=key, cells=changed)
+            )
+
+    async def _insert_row(
+        self, key: str, cells: list[str], index: int | None
+    ) -> None:
+        if index is not None and index < 0:
+            # Client gets actual position, as it can't insert from the end
+            index = max(len(self.rows) + index, 0)
+
+        if index is None or index >= len(self.rows):
+            index = len(self.rows)
+            self.rows[key] = cells
+        else:
+            items = list(self.rows.items())
+            items.insert(index, (key, cells))
+            self.rows = dict(items)
+
+        await Session.get().send_command(
+            InsertRow(table=self.key, key=key, index=index, cells=cells)
+        )
+
+    async def delete_row(self, key: t.Hashable) -> None:
+        key = str(key)
+        if self.rows.pop(key, None) is not None:
+            await Session.get().send_command(
+                DeleteRow(table=self.key, key=key)
+            )
+
+    @on(TableLoad)
+    async def on_table_load(self, event: TableLoad) -> None:
+        if event.table == self.key:
+            await Session.get().send_command(AppendRows(
+                table=self.key, html=render_keyed_rows(self.rows),
+            ))
@@ -0,0 +1,48 @@
+import hashlib
+import re
+from functools import lru_cache
+
+from .html import HTML
+
+VAR_RE = re.compile(r'{{\s*(\w+)\s*}}')
+HTML_VAR_RE = re.compile(r'{{{\s*(\w+)\s*}}}')
+TAG_RE = re.compile(r'(<[^>]*>)')
+
+
+def _compile_tag(tag: HTML) -> HTML:
+    if not VAR_RE.search(tag):
+        return tag
+
+    # Attributes with vars are kept as templates, client finds them by mark
+    end = -2 if tag.endswith('/>') else -1
+    return tag[:end].rstrip() + ' data-bind' + tag[end:]
+
+
+def _compile_text(text: HTML) -> HTML:
+    text = HTML_VAR_RE.sub(r'<span data-var="\1" data-html></span>', text)
+    return VAR_RE.sub(r'<span data-var="\1"></span>', text)
+
+
+@lru_cache(maxsize=4096)
+def compile_template(html: HTML) -> HTML:
+    """Make vars of component template addressable on client
+
+    * `{{ var }}` in text -> `<span data-var="var"></span>`, which text
+      is patched by client on var update (value is shown as text)
+    * `{{{ var }}}` in text -> `<span data-var="var" data-html></span>`,
+      var value is inserted as HTML, so it shouldn't contain user input
+    * tags with `{{ var }}` in attributes are marked with `data-bind`
+
+    Compilation result is cached, so it's done once per template
+    """
+    parts = TAG_RE.split(html)
+    return ''.join(
+        _compile_tag(part) if part.startswith('<') else _compile_text(part)
+        for part in parts
+    )
+
+
+@lru_cache(maxsize=4096)
+def template_hash(html: HTML) -> str:
+    """Content hash of template, used as key of client templates cache"""
+    return hashlib.sha1(html.encode()).hexdigest()[:16]
@@ -1,19 +1,99 @@
-let socket = new WebSocket('ws:/127.0.0.1:5000/')
+// Layout templates cache: hash -> html, persisted in `localStorage`
 
-socket.onopen = event => {
-    console.log(`[WS] CONN_OPEN: ${event.target.url}`)
+const TEMPLATES_KEY = 'sundash.templates'
+const MAX_STORED_TEMPLATES = 32
+
+let templates = _load_templates()
+
+
+function _load_templates() {
+    try {
+        return JSON.parse(localStorage.getItem(TEMPLATES_KEY)) ?? {}
+    }
+    catch {
+        return {}
+    }
+}
+
+
+function _store_template(hash, html) {
+    templates[hash] = html
+
+    let stored = _load_templates()
+    delete stored[hash]
+    stored[hash] = html
+
+    const hashes = Object.keys(stored)
+    while (hashes.length > MAX_STORED_TEMPLATES) {
+        delete stored[hashes.shift()]
+    }
+
+    try {
+        localStorage.setItem(TEMPLATES_KEY, JSON.stringify(stored))
+    }
+    catch {
+        // storage is full or disabled, memory cache is still used
+    }
 }
 
-socket.onmessage = event => {
-    let [name, ...data] = event.data.split(' ')
-    data = data.join(' ')
-    console.log(`${name} ${data}`)
 
-    if (data != undefined) {
-        data = JSON.parse(data)
+// Token of resumable session, kept while browser tab is open
+
+const SESSION_KEY = 'sundash.session'
+const RECONNECT_MIN_DELAY = 500  // ms
+const RECONNECT_MAX_DELAY = 10000  // ms
+
+let session_token = sessionStorage.getItem(SESSION_KEY) ?? ''
+let reconnect_delay = RECONNECT_MIN_DELAY
+let socket = null
+
+
+function connect() {
+    let url = (
+        'ws:/127.0.0.1:5000/?templates=' + Object.keys(templates).join(',')
+    )
+    if (session_token) {
+        // server replays commands which were sent after `seq`
+        url += `&resume=${session_token}&seq=${received_seq}`
     }
 
-    if (name == 'ClearLayout') {
+    socket = new WebSocket(url, ['sundash.bin', 'sundash.text'])
+    socket.binaryType = 'arraybuffer'
+    socket.onopen = on_open
+    socket.onmessage = on_message
+    socket.onclose = on_close
+    socket.onerror = on_error
+}
+
+
+const text_encoder = new TextEncoder()
+const text_decoder = new TextDecoder()
+
+// Protocol settings, received in `Hello` command
+let protocol = {acks: 'each', ack_every: 1, ack_interval: 0, opcodes: {}}
+let opnames = {}  // opcode -> message name (binary protocol)
+let slots = []  // var names by slot index (binary protocol)
+let received_seq = 0
+let acked_seq = 0
+let ack_timer = null
+
+
+function on_open(event) {
+    console.log(`[WS] CONN_OPEN: ${event.target.url}`)
+    reconnect_delay = RECONNECT_MIN_DELAY
+}
+
+
+function on_message(event) {
+    received_seq += 1
+
+    let [name, data] = decode_frame(event.data)
+    console.log(name, data)
+
+    if (name == 'Hello') {
+        hello(data)
+    }
+    else if (name == 'ClearLayout') {
         clear_layout()
     }
     else if (name == 'UpdateLayout') {
@@ -22,12 +102,40 @@ socket.onmessage = event => {
     else if (name == 'SetVar') {
         set_var(data)
     }
+    else if (name == 'SetVars') {
+        set_vars(data)
+    }
+    else if (name == 'InsertComponent') {
+        insert_component(data)
+    }
+    else if (name == 'UpdateComponent') {
+        update_component(data)
+    }
+    else if (name == 'RemoveComponent') {
+        remove_component(data)
+    }
+    else if (name == 'UpdateRows') {
+        update_rows(data)
+    }
+    else if (name == 'AppendRows') {
+        append_rows(data)
+    }
+    else if (name == 'InsertRow') {
+        insert_row(data)
+    }
+    else if (name == 'UpdateCells') {
+        update_cells(data)
+    }
+    else if (name == 'DeleteRow') {
+        delete_row(data)
+    }
     else {
         console.error(`[!!!] dispatching error: ${event.data}`)
     }
 }
 
-socket.onclose = event => {
+
+function on_close(event) {
     if (event.wasClean) {
         console.log(
             `[WS] CONN_CLOSED: code=${event.code} reason=${event.reason}`
@@ -38,69 +146,510 @@ socket.onclose = event => {
        // обычно в этом случае event.code 1006
         console.log('[WS] CONN_ABORTED')
     }
+
+    if (event.code != 1000) {
+        // exponential backoff with jitter, so clients don't reconnect at once
+        const delay = reconnect_delay * (0.5 + Math.random() / 2)
+        reconnect_delay = Math.min(reconnect_delay * 2, RECONNECT_MAX_DELAY)
+        clearTimeout(ack_timer)
+        ack_timer = null
+        setTimeout(connect, delay)
+    }
 }
 
-socket.onerror = error => {
+
+function on_error(error) {
     console.log('[WS] ERROR:')
     console.log(error)
 }
 
 
+function hello(data) {
+    if (data.session != session_token || !data.session) {
+        // new session, commands are counted from `Hello`
+        received_seq = 1
+        acked_seq = 0
+        session_token = data.session
+        sessionStorage.setItem(SESSION_KEY, session_token)
+    }
+
+    protocol = data
+    opnames = {}
+    for (let key in protocol.opcodes) {
+        opnames[protocol.opcodes[key]] = key
+    }
+}
+
+
 const app = document.getElementById('app')
 
 
+function decode_frame(frame) {
+    if (typeof frame == 'string') {
+        let [name, ...data] = frame.split(' ')
+        return [name, JSON.parse(data.join(' '))]
+    }
+
+    const bytes = new Uint8Array(frame)
+    if (bytes[0] == 0) {
+        // SetVar of var in slot: <u8 0><u16 slot><json value>
+        const slot = (bytes[1] << 8) | bytes[2]
+        const value = JSON.parse(text_decoder.decode(bytes.subarray(3)))
+        return ['SetVar', {name: slots[slot], value: value}]
+    }
+
+    const data = JSON.parse(text_decoder.decode(bytes.subarray(1)))
+    return [opnames[bytes[0]], data]
+}
+
+
+function send_event(name, data) {
+    const payload = JSON.stringify(data)
+
+    if (socket.protocol == 'sundash.bin') {
+        const body = text_encoder.encode(payload)
+        const frame = new Uint8Array(body.length + 1)
+        frame[0] = protocol.opcodes[name]
+        frame.set(body, 1)
+        socket.send(frame)
+    }
+    else {
+        socket.send(`${name} ${payload}`)
+    }
+}
+
+
+function _send_ack() {
+    clearTimeout(ack_timer)
+    ack_timer = null
+    acked_seq = received_seq
+    send_event('Ack', {seq: acked_seq})
+}
+
+
+function _ack(event_name) {
+    if (protocol.acks == 'each') {
+        send_event(event_name, {})
+    }
+    else if (protocol.acks == 'cumulative') {
+        if (received_seq - acked_seq >= protocol.ack_every) {
+            _send_ack()
+        }
+        else if (ack_timer == null) {
+            ack_timer = setTimeout(_send_ack, protocol.ack_interval * 1000)
+        }
+    }
+}
+
+
 function clear_layout() {
     app.innerHTML = ''
-    socket.send('LayoutClean {}')
+    send_event('LayoutClean', {})
 }
 
 
-function _init_buttons() {
-    const buttons = [...document.getElementsByTagName('button')]
-    buttons.forEach(button => {
-        button.onclick = () => {
-            socket.send(`ButtonClick {"button_id": "${button.id}"}`)
+// Events are delegated to app root, so they don't need rebinding on render
+
+app.addEventListener('click', event => {
+    const sort = event.target.closest('[data-sort]')
+    if (sort != null) {
+        send_event('TableSort', {
+            table: _get_table(sort).dataset.table,
+            column: Number(sort.dataset.sort),
+        })
+        return
+    }
+
+    const button = event.target.closest('button')
+    if (button != null && app.contains(button)) {
+        send_event('ButtonClick', {button_id: button.id})
+    }
+})
+
+
+app.addEventListener('change', event => {
+    const input = event.target
+    const skip = 'tableFilter' in input.dataset || 'live' in input.dataset
+    if (input.tagName == 'INPUT' && !skip) {
+        send_event('InputUpdated', {name: input.name, value: input.value})
+        input.value = ''
+    }
+})
+
+
+// Call `func` at most once per `delay` ms (first and last calls are made)
+
+let throttled = {}  // key -> arguments of delayed call or null
+
+const LIVE_DELAY = 200  // ms, live inputs, see `input` listener below
+
+
+function throttle(key, delay, func, ...args) {
+    if (key in throttled) {
+        throttled[key] = args
+        return
+    }
+
+    func(...args)
+    throttled[key] = null
+    setTimeout(() => {
+        const last_args = throttled[key]
+        delete throttled[key]
+        if (last_args != null) {
+            throttle(key, delay, func, ...last_args)
         }
-    })
+    }, delay)
+}
+
+
+// Virtual tables, see `sundash.tables.VirtualTableComponent`
+
+const TABLE_SCROLL_DELAY = 50  // ms
+const TABLE_FILTER_DELAY = 200  // ms
+
+
+function _get_table(node) {
+    return node.closest('[data-table]')
+}
+
+
+function _init_tables(root) {
+    for (const table of root.querySelectorAll('[data-table]')) {
+        send_event('TableScroll', {table: table.dataset.table, offset: 0})
+    }
+    for (const table of root.querySelectorAll('[data-stream]')) {
+        table.__rows = null  // rows of live table are not loaded yet
+        send_event('TableLoad', {table: table.dataset.stream})
+    }
+}
+
+
+function _on_table_scroll(viewport) {
+    const table = _get_table(viewport)
+    const row_height = Number(table.dataset.rowHeight)
+    const head_height = viewport.querySelector('thead').offsetHeight
+    const first = Math.floor(
+        Math.max(viewport.scrollTop - head_height, 0) / row_height
+    )
+    const visible = Math.ceil(viewport.clientHeight / row_height)
+
+    const offset = Number(table.dataset.offset ?? 0)
+    const count = Number(table.dataset.count ?? 0)
+    if (first < offset || first + visible > offset + count) {
+        send_event('TableScroll', {table: table.dataset.table, offset: first})
+    }
 }
 
 
-function _init_inputs() {
-    const inputs = [...document.getElementsByTagName('input')]
-    inputs.forEach(input => {
-        console.log(input)
-        input.onchange = (e) => {
-            socket.send(`InputUpdated {"name": "${input.name}", "value": "${input.value}"}`)
-            e.target.value = ''
+app.addEventListener('scroll', event => {
+    const viewport = event.target
+    if (viewport.classList?.contains('sd-table-viewport')) {
+        throttle(
+            'scroll:' + _get_table(viewport).dataset.table,
+            TABLE_SCROLL_DELAY, _on_table_scroll, viewport,
+        )
+    }
+}, true)  // scroll doesn't bubble
+
+
+app.addEventListener('input', event => {
+    const input = event.target
+    if ('tableFilter' in input.dataset) {
+        const table = _get_table(input).dataset.table
+        throttle(
+            'filter:' + table, TABLE_FILTER_DELAY,
+            () => send_event('TableFilter', {table: table, query: input.value}),
+        )
+    }
+    else if ('live' in input.dataset) {
+        // Live input `<input name="search" data-live="300">` reports value
+        // while typing, at most once per given ms (or default delay)
+        throttle(
+            'input:' + input.name, Number(input.dataset.live) || LIVE_DELAY,
+            () => send_event(
+                'InputUpdated', {name: input.name, value: input.value},
+            ),
+        )
+    }
+})
+
+
+function update_rows(data) {
+    const table = app.querySelector(`[data-table="${data.table}"]`)
+    if (table == null) {
+        return
+    }
+
+    const row_height = Number(table.dataset.rowHeight)
+    const tbody = table.querySelector('tbody')
+    tbody.innerHTML = data.html
+    const count = tbody.rows.length
+
+    // Spacers keep scroll height of whole table
+    const before = document.createElement('tr')
+    before.style.height = `${data.offset * row_height}px`
+    tbody.prepend(before)
+
+    const after = document.createElement('tr')
+    after.style.height = `${(data.total - data.offset - count) * row_height}px`
+    tbody.append(after)
+
+    table.dataset.offset = data.offset
+    table.dataset.count = count
+
+    _ack('LayoutUpdated')
+}
+
+
+// Chunk of streamed table, see `sundash.tables.ColumnarTableComponent`
+function append_rows(data) {
+    const table = app.querySelector(`[data-stream="${data.table}"]`)
+    if (table != null) {
+        table.tBodies[0].insertAdjacentHTML('beforeend', data.html)
+        if ('live' in table.dataset) {
+            _index_rows(table)
+        }
+    }
+
+    _ack('LayoutUpdated')
+}
+
+
+// Keyed rows of live table, see `sundash.tables.LiveTableComponent`
+
+function _index_rows(table) {
+    table.__rows = new Map()
+    for (const row of table.tBodies[0].rows) {
+        table.__rows.set(row.dataset.key, row)
+    }
+}
+
+
+// Get rows index of live table, `null` until all rows are loaded (row
+// commands sent before that are already applied to loaded rows)
+function _get_live_rows(name) {
+    const table = app.querySelector(`[data-stream="${name}"]`)
+    return table?.__rows ? [table, table.__rows] : [null, null]
+}
+
+
+function insert_row(data) {
+    const [table, rows] = _get_live_rows(data.table)
+    if (rows != null && !rows.has(data.key)) {
+        const tbody = table.tBodies[0]
+        const row = document.createElement('tr')
+        row.dataset.key = data.key
+        for (const value of data.cells) {
+            row.insertCell().textContent = value
+        }
+        tbody.insertBefore(row, tbody.rows[data.index] ?? null)
+        rows.set(data.key, row)
+    }
+
+    _ack('LayoutUpdated')
+}
+
+
+function update_cells(data) {
+    const row = _get_live_rows(data.table)[1]?.get(data.key)
+    if (row != null) {
+        for (const index in data.cells) {
+            row.cells[Number(index)].textContent = data.cells[index]
+        }
+    }
+
+    _ack('LayoutUpdated')
+}
+
+
+function delete_row(data) {
+    const rows = _get_live_rows(data.table)[1]
+    const row = rows?.get(data.key)
+    if (row != null) {
+        row.remove()
+        rows.delete(data.key)
+    }
+
+    _ack('LayoutUpdated')
+}
+
+
+// Var bindings, see `sundash.templates.compile_template`
+
+const VAR_RE = /{{\s*(\w+)\s*}}/g
+
+let bindings = {}  // var name -> [{node, attr, template}]
+
+
+function _add_binding(name, binding) {
+    if (!(name in bindings)) {
+        bindings[name] = []
+    }
+    bindings[name].push(binding)
+}
+
+
+// Add bindings of nodes inside `root`, return bound var names
+function _bind(root) {
+    const names = new Set()
+    for (const node of root.querySelectorAll('[data-var]')) {
+        _add_binding(node.dataset.var, {
+            node: node, attr: null, html: 'html' in node.dataset,
+        })
+        names.add(node.dataset.var)
+    }
+
+    for (const node of root.querySelectorAll('[data-bind]')) {
+        for (const attr of [...node.attributes]) {
+            for (const match of attr.value.matchAll(VAR_RE)) {
+                _add_binding(match[1], {
+                    node: node, attr: attr.name, template: attr.value,
+                })
+                names.add(match[1])
+            }
         }
-    })
+    }
+    return names
+}
+
+
+function _unbind(root) {
+    for (let name in bindings) {
+        bindings[name] = bindings[name].filter(b => !root.contains(b.node))
+    }
+}
+
+
+function _var_value(name) {
+    return app.__vars[name] ?? ''
+}
+
+
+function _patch(name) {
+    for (const binding of bindings[name] ?? []) {
+        if (binding.html) {
+            binding.node.innerHTML = _var_value(name)
+        }
+        else if (binding.attr == null) {
+            binding.node.textContent = _var_value(name)
+        }
+        else {
+            binding.node.setAttribute(
+                binding.attr,
+                binding.template.replace(VAR_RE, (_, key) => _var_value(key)),
+            )
+        }
+    }
+}
+
+
+// Get html of command from itself or templates cache
+function _get_html(data) {
+    if (data.html != null) {
+        if (data.hash) {
+            _store_template(data.hash, data.html)
+        }
+        return data.html
+    }
+
+    const html = templates[data.hash]
+    if (html == undefined) {
+        send_event('TemplateMissing', {hash: data.hash})
+        return null
+    }
+    return html
 }
 
 
 function update_layout(data) {
-    app.innerHTML = ''
-    app.__html = data.html
+    const html = _get_html(data)
+    if (html == null) {
+        return
+    }
+
     app.__vars = data.vars
+    slots = Object.keys(data.vars)
 
-    let response_html = app.__html
-    for (let key in app.__vars) {
-        let value = app.__vars[key]
-        response_html = response_html.replace(`{{ ${key} }}`, value)
+    app.innerHTML = html
+    bindings = {}
+    for (const name of _bind(app)) {
+        _patch(name)
     }
+    _init_tables(app)
 
-    app.innerHTML = response_html
-    _init_buttons()
-    _init_inputs()
-    
-    socket.send('LayoutUpdated {}')
+    _ack('LayoutUpdated')
+}
+
+
+function _get_component(id) {
+    return app.querySelector(`:scope > sd-component[data-id="${id}"]`)
+}
+
+
+function insert_component(data) {
+    const html = _get_html(data)
+    if (html == null) {
+        return
+    }
+
+    for (let name in data.vars) {
+        app.__vars[name] = data.vars[name]
+        if (!slots.includes(name)) {
+            slots.push(name)
+        }
+    }
+
+    const component = document.createElement('sd-component')
+    component.dataset.id = data.id
+    component.innerHTML = html
+    app.insertBefore(component, app.children[data.index] ?? null)
+
+    for (const name of _bind(component)) {
+        _patch(name)
+    }
+    _init_tables(component)
+
+    _ack('LayoutUpdated')
+}
+
+
+function update_component(data) {
+    Object.assign(app.__vars, data.vars)
+    for (let name in data.vars) {
+        _patch(name)
+    }
+
+    _ack('LayoutUpdated')
+}
+
+
+function remove_component(data) {
+    const component = _get_component(data.id)
+    if (component != null) {
+        _unbind(component)
+        component.remove()
+    }
+
+    _ack('LayoutUpdated')
 }
 
 
 function set_var(data) {
     app.__vars[data.name] = data.value
-    app.innerHTML = app.__html.replace(`{{ ${data.name} }}`, data.value)
-    _init_buttons()
-    _init_inputs()
-    
-    socket.send('VarSet {}')
+    _patch(data.name)
+
+    _ack('VarSet')
 }
+
+
+function set_vars(data) {
+    Object.assign(app.__vars, data.vars)
+    for (let name in data.vars) {
+        _patch(name)
+    }
+
+    _ack('VarSet')
+}
+
+
+connect()